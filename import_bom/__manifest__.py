@@ -11,5 +11,7 @@
     'data': [
         'security/ir.model.access.csv',
         'views/import_bom_views.xml',
+        'views/bom_import_log_views.xml',
+        'data/ir_cron.xml',
     ],
 }
@@ -1,3 +1,4 @@
 # -*- coding: utf-8 -*-
 
 from . import mrp_bom
+from . import bom_import_log
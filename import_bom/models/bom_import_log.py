@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, fields, models, _
+
+import base64
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class BomImportLog(models.Model):
+    _name = 'bom.import.log'
+    _description = 'BoM Import Log'
+    _order = 'id desc'
+
+    name = fields.Char('Reference', compute='_compute_name')
+    bom_id = fields.Many2one('mrp.bom', 'Bill of Materials', ondelete='cascade')
+    user_id = fields.Many2one('res.users', 'User', default=lambda self: self.env.user, readonly=True)
+    file = fields.Binary('File', attachment=True)
+    delete_old_values = fields.Boolean('Delete old Values')
+    sync_lines = fields.Boolean('Synchronize Lines')
+    dry_run = fields.Boolean('Dry Run')
+    multi_bom = fields.Selection([
+        ('sheet', 'One sheet per BoM'),
+        ('column', 'Parent product in first column'),
+    ], 'Multiple BoMs')
+    streaming = fields.Boolean('Streaming Import', default=True)
+    chunk_size = fields.Integer('Batch Size', default=1000)
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], 'Status', default='queued', readonly=True)
+    date_start = fields.Datetime('Started on', readonly=True)
+    date_end = fields.Datetime('Finished on', readonly=True)
+    rows_done = fields.Integer('Rows Done', readonly=True)
+    rows_per_second = fields.Float('Rows per Second', readonly=True)
+    errors = fields.Text('Errors', readonly=True)
+    summary = fields.Text('Summary', readonly=True)
+
+    @api.depends('bom_id')
+    def _compute_name(self):
+        for log in self:
+            log.name = '%s #%s' % (log.bom_id.display_name or _('Multiple BoMs'), log.id)
+
+    def _get_wizard(self):
+        """Return an import wizard carrying the options of the log."""
+        return self.env['wizard.import.bom'].with_user(self.user_id).create({
+            'delete_old_values': self.delete_old_values,
+            'sync_lines': self.sync_lines,
+            'multi_bom': self.multi_bom,
+            'dry_run': self.dry_run,
+            'streaming': self.streaming,
+            'chunk_size': self.chunk_size,
+        })
+
+    def _commit(self):
+        # tests run in a single transaction that must not be committed
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+
+    def _write_progress(self, rows_done, rows_per_second):
+        """Write the progress of the import in a transaction of its own, so
+        it can be followed from other sessions while the import itself is
+        only committed once done."""
+        if getattr(threading.current_thread(), 'testing', False):
+            self.write({'rows_done': rows_done, 'rows_per_second': rows_per_second})
+            return
+        with self.pool.cursor() as cr:
+            cr.execute(
+                "UPDATE bom_import_log SET rows_done = %s, rows_per_second = %s "
+                "WHERE id = %s", (rows_done, rows_per_second, self.id))
+
+    def _run(self):
+        """Run the import of the log in a single transaction: a failed import
+        leaves the BoMs untouched and can be requeued from the start. The
+        progress is written after each chunk of lines."""
+        self.ensure_one()
+        self.write({'state': 'running', 'date_start': fields.Datetime.now()})
+        self._commit()
+        start = time.perf_counter()
+
+        def progress(rows_done):
+            elapsed = time.perf_counter() - start
+            self._write_progress(rows_done, rows_done / elapsed if elapsed else 0.0)
+
+        try:
+            with self.env.cr.savepoint():
+                wizard = self._get_wizard()
+                stats = wizard._import_file(
+                    base64.b64decode(self.file), bom=self.bom_id.with_user(self.user_id),
+                    progress=progress)
+        except Exception as e:
+            _logger.exception("BoM import %s failed", self.id)
+            vals = {
+                'state': 'failed',
+                'errors': str(e.args[0] if e.args else e),
+                'rows_done': 0,
+                'rows_per_second': 0.0,
+            }
+        else:
+            vals = {
+                'state': 'done',
+                'rows_done': stats['lines'],
+                'rows_per_second': stats['speed'],
+                'summary': wizard._format_stats(stats),
+            }
+        # commit the lines first: the log is written from a new transaction,
+        # which sees the progress committed in the meantime
+        self._commit()
+        vals['date_end'] = fields.Datetime.now()
+        self.write(vals)
+        self._commit()
+
+    @api.model
+    def _cron_process_queue(self, limit=None):
+        for log in self.search([('state', '=', 'queued')], order='id', limit=limit):
+            log._run()
+
+    def action_requeue(self):
+        self.filtered(lambda l: l.state == 'failed').write({
+            'state': 'queued',
+            'errors': False,
+            'rows_done': 0,
+            'rows_per_second': 0.0,
+        })
+        self.env.ref('import_bom.ir_cron_bom_import_log').sudo()._trigger()
@@ -1,16 +1,42 @@
 # -*- coding: utf-8 -*-
 
-from odoo import api, fields, models, _
-from odoo.tools.float_utils import float_is_zero, float_compare
-from odoo.exceptions import ValidationError, UserError
-from odoo.tools import DEFAULT_SERVER_DATETIME_FORMAT
-import datetime
-
-from io import BytesIO
-import odoo.tools as tools
-import openpyxl
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools.float_utils import float_compare
+
+from collections import Counter, defaultdict
+from io import BytesIO, TextIOWrapper
 import base64
-import re
+import codecs
+import csv
+import logging
+import time
+
+import openpyxl
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+XLSX_SIGNATURE = b'PK\x03\x04'
+PARQUET_SIGNATURE = b'PAR1'
+# legacy .xls workbooks and other OLE compound documents
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+
+def _is_text(sample):
+    """Return whether the start of a file ``sample`` reads as UTF-8 text,
+    a multibyte character cut at its end being accepted."""
+    if b'\x00' in sample:
+        return False
+    try:
+        codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
 
 
 class WizardImportBom(models.TransientModel):
@@ -20,48 +46,455 @@ class WizardImportBom(models.TransientModel):
     name = fields.Binary('File')
     msg = fields.Text('Messages', readonly=True)
     delete_old_values=fields.Boolean('Delete old Values',default=False)
+    streaming = fields.Boolean(
+        'Streaming Import', default=True,
+        help="Read xlsx workbooks in read-only mode, row by row, without "
+             "loading their cells in memory. The lines to import are still "
+             "all kept in memory until they are created.")
+    chunk_size = fields.Integer(
+        'Batch Size', default=1000,
+        help="Number of BoM lines created per ORM call.")
+    sync_lines = fields.Boolean(
+        'Synchronize Lines', default=False,
+        help="Match the rows of the file with the existing lines by product "
+             "and operation: only changed quantities are written, new rows "
+             "are created and lines missing from the file are deleted.")
+    multi_bom = fields.Selection([
+        ('sheet', 'One sheet per BoM'),
+        ('column', 'Parent product in first column'),
+    ], 'Multiple BoMs',
+        help="Fill several bills of materials from one file, either one "
+             "sheet per BoM named after the internal reference of the "
+             "product, or with the internal reference of the product in "
+             "the first column. Missing BoMs are created.")
+    dry_run = fields.Boolean(
+        'Dry Run', default=False,
+        help="Only check the file and report every problem found in it, "
+             "without writing anything.")
+    background = fields.Boolean(
+        'Run in Background', default=False,
+        help="Queue the import as a background job instead of waiting for "
+             "it. Its progress can be followed in the BoM import logs.")
 
-    
-    def import_bom(self):
-        fdata = self.name and base64.decodestring(self.name) or False
-        msg = ''
+    def _read_sheets(self, fdata):
+        """Yield ``(sheet title, rows)`` for every sheet of the file,
+        ``rows`` yielding ``(row number, values)`` for every data row,
+        skipping the header row. Each sheet must be consumed before the next
+        one is read.
+
+        The format is chosen from the signature of the file: xlsx workbooks
+        and Parquet files are recognized, text files are read as CSV and
+        anything else is rejected.
+        """
+        if fdata.startswith(XLSX_SIGNATURE):
+            return self._read_sheets_xlsx(fdata)
+        if fdata.startswith(PARQUET_SIGNATURE):
+            return self._read_sheets_parquet(fdata)
+        if fdata.startswith(OLE_SIGNATURE):
+            raise UserError(_(
+                'Legacy .xls workbooks are not supported: save the file as an '
+                'xlsx workbook or as CSV.'))
+        if not _is_text(fdata[:4096]):
+            raise UserError(_(
+                'Unsupported file format: import an xlsx workbook, a Parquet '
+                'file or a CSV file encoded in UTF-8.'))
+        return self._read_sheets_csv(fdata)
+
+    def _read_sheets_xlsx(self, fdata):
+        wb = openpyxl.load_workbook(
+            BytesIO(fdata), read_only=self.streaming, data_only=True)
+        try:
+            for sheet in wb.worksheets:
+                yield sheet.title, enumerate(
+                    sheet.iter_rows(min_row=2, values_only=True), start=2)
+        finally:
+            # read-only workbooks keep the archive open until closed
+            wb.close()
+
+    def _read_sheets_csv(self, fdata):
+        sample = fdata[:4096].decode('utf-8-sig', errors='ignore')
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(
+            TextIOWrapper(BytesIO(fdata), encoding='utf-8-sig', newline=''), dialect)
+
+        def rows():
+            try:
+                next(reader, None)
+                yield from enumerate(reader, start=2)
+            except UnicodeDecodeError:
+                raise UserError(_('CSV files must be encoded in UTF-8.'))
+
+        yield '', rows()
+
+    def _read_sheets_parquet(self, fdata):
+        if pq is None:
+            raise UserError(_('Reading Parquet files requires the pyarrow library.'))
+        parquet_file = pq.ParquetFile(BytesIO(fdata))
+
+        def rows():
+            # the header is the schema: the first data row is numbered 2 as
+            # in the other formats
+            row_num = 2
+            for batch in parquet_file.iter_batches():
+                for row in zip(*(column.to_pylist() for column in batch.columns)):
+                    yield row_num, row
+                    row_num += 1
+
+        yield '', rows()
+
+    def _read_rows(self, fdata):
+        """Yield ``(row number, values)`` for every data row of the first
+        sheet."""
+        for title, rows in self._read_sheets(fdata):
+            yield from rows
+            break
+
+    def _read_bom_rows(self, fdata):
+        """Return the rows of the file grouped by the internal reference of
+        the BoM product, as ``{code: [(row number, values)]}``. Without
+        ``multi_bom``, all the rows are returned under the ``False`` key."""
+        if not self.multi_bom:
+            return {False: self._read_rows(fdata)}
+        groups = defaultdict(list)
+        if self.multi_bom == 'sheet':
+            if not fdata.startswith(XLSX_SIGNATURE):
+                raise UserError(_(
+                    'Only xlsx workbooks have one sheet per BoM: give the '
+                    'parent product in the first column of CSV and Parquet '
+                    'files instead.'))
+            for title, rows in self._read_sheets(fdata):
+                groups[title.strip()].extend(rows)
+        else:
+            for row_num, row in self._read_rows(fdata):
+                if row and row[0]:
+                    groups[str(row[0])].append((row_num, row[1:]))
+        return groups
+
+    def _parse_rows(self, rows, errors=None):
+        """Turn raw sheet rows into ``(row number, product code, quantity,
+        operation name)`` tuples, ignoring rows without a product code.
+
+        Invalid quantities raise a ``UserError``, unless an ``errors`` list
+        is given: the problem is then appended to it and the quantity of the
+        line is ``None``.
+        """
+        lines = []
+        for row_num, row in rows:
+            if not row or not row[0]:
+                continue
+            product_name = str(row[0])
+            product_qty = 1
+            if len(row) >= 2:
+                try:
+                    product_qty = float(row[1])
+                except (TypeError, ValueError):
+                    error = _('Row %s: %s is not a valid quantity') % (row_num, row[1])
+                    if errors is None:
+                        raise UserError(error)
+                    errors.append(error)
+                    product_qty = None
+            operation_name = str(row[2]) if len(row) >= 3 and row[2] else False
+            lines.append((row_num, product_name, product_qty, operation_name))
+        return lines
+
+    def _get_product_index(self, codes, errors=None):
+        """Fetch every product whose internal reference is in ``codes`` with
+        a single query and return a ``{default_code: product id}`` dict.
+
+        Raise one ``UserError`` listing all the codes that do not match any
+        product, or append that message to ``errors`` when given.
+        """
+        index = {}
+        if codes:
+            products = self.env['product.product'].search_read(
+                [('default_code', 'in', list(codes))], ['default_code'])
+            for product in products:
+                # keep the first match, as the former search(limit=1) did
+                index.setdefault(product['default_code'], product['id'])
+        missing = sorted(set(codes) - set(index))
+        if missing:
+            error = _('%s is not in products') % ', '.join(missing)
+            if errors is None:
+                raise UserError(error)
+            errors.append(error)
+        return index
+
+    def _get_operation_index(self, bom, names, errors=None):
+        """Map the operation names of ``names`` to the ids of the operations
+        of ``bom``, reading the operations once.
+
+        Raise one ``UserError`` listing all the names that are not
+        operations of the BoM, or append that message to ``errors`` when
+        given.
+        """
+        index = {}
+        for operation in bom.operation_ids:
+            index.setdefault(operation.name, operation.id)
+        missing = sorted(set(names) - set(index))
+        if missing:
+            error = _('%s is not an operation of the bill of materials') % ', '.join(missing)
+            if errors is None:
+                raise UserError(error)
+            errors.append(error)
+        return index
+
+    def _check_lines(self, lines):
+        """Return the problems of ``lines`` that the import itself accepts:
+        negative quantities and product/operation pairs given twice. The
+        checks run on whole columns rather than line by line."""
+        if not lines:
+            return []
+        errors = []
+        row_nums, codes, quantities, operations = zip(*lines)
+        errors += [
+            _('Row %s: the quantity %s is negative') % (row_num, qty)
+            for row_num, qty in zip(row_nums, quantities)
+            if qty is not None and qty < 0
+        ]
+        counts = Counter(zip(codes, operations))
+        seen = set()
+        for row_num, key in zip(row_nums, zip(codes, operations)):
+            if counts[key] > 1 and key not in seen:
+                seen.add(key)
+                errors.append(
+                    _('Row %s: %s appears %s times with the operation %s') % (
+                        row_num, key[0], counts[key], key[1] or _('(none)')))
+        return errors
+
+    def _create_lines(self, vals_list, progress=None):
+        """Create the BoM lines of ``vals_list`` with one ``create`` call per
+        chunk of ``chunk_size`` values, so the ORM batches the inserts and
+        the recomputations.
+
+        ``progress``, if given, is called after each chunk with the number
+        of lines created so far.
+        """
         bom_line_obj = self.env['mrp.bom.line']
-        bom_obj=self.env['mrp.bom']
-        product_obj = self.env['product.product']
-        operation_obj=self.env['mrp.routing.workcenter']
-        input = BytesIO(fdata)
-        bom=bom_obj.browse(self._context.get('active_id'))
-        if self.delete_old_values:
-            bom.bom_line_ids.unlink()
-        input.seek(0)
-        wb = openpyxl.load_workbook(input)
-        sheet = wb._sheets[0]
-        operation_id=False
+        chunk_size = self.chunk_size if self.chunk_size > 0 else len(vals_list) or 1
+        for index in range(0, len(vals_list), chunk_size):
+            bom_line_obj.create(vals_list[index:index + chunk_size])
+            if progress:
+                progress(min(index + chunk_size, len(vals_list)))
+
+    def _get_boms(self, codes, product_index, create=True):
+        """Return ``{code: mrp.bom}`` with the BoM of the product of each
+        internal reference of ``codes``, creating the missing ones unless
+        ``create`` is false."""
+        bom_obj = self.env['mrp.bom']
+        products = self.env['product.product'].browse([product_index[code] for code in codes])
+        bom_by_product = bom_obj._bom_find(products, bom_type='normal')
+        missing = products.filtered(lambda p: not bom_by_product.get(p))
+        if not create:
+            return {code: bom_by_product[product] for code, product in zip(codes, products)}
+        new_boms = bom_obj.create([{
+            'product_tmpl_id': product.product_tmpl_id.id,
+            'product_id': product.product_tmpl_id.product_variant_count > 1 and product.id,
+            'product_qty': 1.0,
+        } for product in missing])
+        bom_by_product.update(zip(missing, new_boms))
+        return {code: bom_by_product[product] for code, product in zip(codes, products)}
+
+    def _prepare_line_vals(self, bom, lines, product_index, operation_index):
+        return [{
+            'bom_id': bom.id,
+            'product_id': product_index[product_name],
+            'product_qty': product_qty,
+            'operation_id': operation_index.get(operation_name, False),
+        } for row_num, product_name, product_qty, operation_name in lines]
+
+    def _sync_lines(self, bom, vals_list):
+        """Bring the lines of ``bom`` in line with ``vals_list`` touching only
+        the lines that differ.
+
+        Return the values of the lines left to create and a dict with the
+        number of lines ``updated``, ``deleted`` and ``unchanged``.
+        """
+        bom_line_obj = self.env['mrp.bom.line']
+        precision = self.env['decimal.precision'].precision_get('Product Unit of Measure')
+        existing = defaultdict(list)
+        for line in bom.bom_line_ids:
+            existing[(line.product_id.id, line.operation_id.id)].append(line)
+        to_create = []
+        to_update = defaultdict(list)
+        unchanged = 0
+        for vals in vals_list:
+            matches = existing.get((vals['product_id'], vals['operation_id']))
+            if not matches:
+                to_create.append(vals)
+                continue
+            line = matches.pop(0)
+            if float_compare(line.product_qty, vals['product_qty'], precision_digits=precision):
+                to_update[vals['product_qty']].append(line.id)
+            else:
+                unchanged += 1
+        to_delete = [line.id for lines in existing.values() for line in lines]
+        # one write per distinct quantity rather than one per line
+        for product_qty, line_ids in to_update.items():
+            bom_line_obj.browse(line_ids).write({'product_qty': product_qty})
+        bom_line_obj.browse(to_delete).unlink()
+        return to_create, {
+            'updated': sum(len(line_ids) for line_ids in to_update.values()),
+            'deleted': len(to_delete),
+            'unchanged': unchanged,
+        }
+
+    def _dry_run(self, bom_rows, bom, start):
+        """Check the rows of ``bom_rows``, grouped as returned by
+        ``_read_bom_rows()``, as the import would, and return the stats of
+        the run with every problem found in ``errors`` instead of raising on
+        the first one."""
+        errors = []
+        group_errors = {}
+        groups = {}
+        for code, rows in bom_rows.items():
+            group_errors[code] = []
+            groups[code] = self._parse_rows(rows, group_errors[code])
+        codes = {line[1] for lines in groups.values() for line in lines}
+        if self.multi_bom:
+            codes |= set(groups)
+        product_index = self._get_product_index(codes, errors)
+        if self.multi_bom:
+            boms = self._get_boms(
+                [code for code in groups if code in product_index], product_index,
+                create=False)
+        else:
+            boms = {False: bom}
+        for code, lines in groups.items():
+            self._get_operation_index(
+                boms.get(code, self.env['mrp.bom']),
+                {line[3] for line in lines if line[3]}, group_errors[code])
+            group_errors[code] += self._check_lines(lines)
+            errors += [
+                '%s: %s' % (code, error) if code else error
+                for error in group_errors[code]
+            ]
+        line_count = sum(len(lines) for lines in groups.values())
+        elapsed = time.perf_counter() - start
+        return {
+            'boms': len(groups),
+            'lines': line_count,
+            'errors': errors,
+            'seconds': elapsed,
+            'speed': line_count / elapsed if elapsed else 0.0,
+        }
+
+    def _import_file(self, fdata, bom=None, progress=None):
+        """Import the lines of the file content ``fdata`` into ``bom``, or
+        into the BoMs named in the file with ``multi_bom``, and return a
+        dict with the number of ``boms`` and ``lines``, the elapsed
+        ``seconds`` and the ``speed`` in rows per second."""
+        start = time.perf_counter()
+        if self.dry_run:
+            return self._dry_run(self._read_bom_rows(fdata), bom, start)
+        groups = {
+            code: self._parse_rows(rows)
+            for code, rows in self._read_bom_rows(fdata).items()
+        }
+        codes = {line[1] for lines in groups.values() for line in lines}
+        if self.multi_bom:
+            codes |= set(groups)
+        # a single product lookup shared by all the BoMs of the file
+        product_index = self._get_product_index(codes)
+        if self.multi_bom:
+            boms = self._get_boms(list(groups), product_index)
+        else:
+            boms = {False: bom}
+        vals_by_bom = []
+        for code, lines in groups.items():
+            operation_index = self._get_operation_index(
+                boms[code], {line[3] for line in lines if line[3]})
+            vals_by_bom.append((boms[code], self._prepare_line_vals(
+                boms[code], lines, product_index, operation_index)))
+        stats = {}
+        to_create = []
+        old_lines = self.env['mrp.bom.line']
+        for bom, vals_list in vals_by_bom:
+            if self.sync_lines:
+                vals_list, bom_stats = self._sync_lines(bom, vals_list)
+                for key, value in bom_stats.items():
+                    stats[key] = stats.get(key, 0) + value
+            elif self.delete_old_values:
+                old_lines |= bom.bom_line_ids
+            to_create += vals_list
+        old_lines.unlink()
+        # the lines of all the BoMs are created together, in chunks that may
+        # span several BoMs
+        self._create_lines(to_create, progress=progress)
+        line_count = sum(len(lines) for lines in groups.values())
+        elapsed = time.perf_counter() - start
+        speed = line_count / elapsed if elapsed else 0.0
+        _logger.info(
+            "Imported %s lines into %s BoMs in %.2fs (%.0f rows/s)",
+            line_count, len(groups), elapsed, speed)
+        stats.update({
+            'boms': len(groups),
+            'lines': line_count,
+            'created': len(to_create),
+            'seconds': elapsed,
+            'speed': speed,
+        })
+        return stats
+
+    def _format_stats(self, stats):
+        if 'errors' in stats:
+            if not stats['errors']:
+                return _('Dry run: %(lines)s lines checked in %(seconds).2f seconds, '
+                         'no problem found.') % stats
+            return '\n'.join(
+                [_('Dry run: %s problems found in %s lines:') % (len(stats['errors']), stats['lines'])]
+                + stats['errors'])
+        msg = _('%(lines)s lines imported in %(seconds).2f seconds (%(speed).0f rows/s).') % stats
+        if self.multi_bom:
+            msg += '\n' + _('%(boms)s bills of materials updated.') % stats
+        if 'updated' in stats:
+            msg += '\n' + _('%(created)s created, %(updated)s updated, %(deleted)s deleted, '
+                            '%(unchanged)s unchanged.') % stats
+        return msg
+
+    def _reopen_wizard(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+            'context': self._context,
+        }
+
+    def _queue_import(self, bom):
+        """Store the file in a queued import log and wake up the cron that
+        processes it."""
+        log = self.env['bom.import.log'].create({
+            'bom_id': bom.id,
+            'file': self.name,
+            'delete_old_values': self.delete_old_values,
+            'sync_lines': self.sync_lines,
+            'multi_bom': self.multi_bom,
+            'dry_run': self.dry_run,
+            'streaming': self.streaming,
+            'chunk_size': self.chunk_size,
+        })
+        self.env.ref('import_bom.ir_cron_bom_import_log').sudo()._trigger()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'bom.import.log',
+            'res_id': log.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
+
+    def import_bom(self):
+        if not self.name:
+            raise UserError(_('Please select a file to import.'))
+        bom=self.env['mrp.bom'].browse(not self.multi_bom and self._context.get('active_id'))
         #upgrade fix
-#         if bom_obj.browse(self._context.get('active_id')).state == 'release':
+#         if bom.state == 'release':
 #             raise UserError(_("You can not import to released Bom"))
-#         else:
-        for rowNum in range(2, sheet.max_row+1):
-                if sheet.cell(row=rowNum, column=1).value:
-                    product_name = str(sheet.cell(row=rowNum, column=1).value)
-                else:
-                    continue
-                product = product_obj.search([('default_code', '=', product_name)],limit=1)
-                if not product:
-                    raise UserError(_('%s is not in products' %(product_name)))
-                if sheet.max_column >= 2:
-                    product_qty = float(sheet.cell(row=rowNum, column=2).value)
-                else:
-                    product_qty = 1
-                if sheet.max_column >=3 :
-                    operations=bom.operation_ids.mapped('name')
-                    operation_id=operation_obj.search(
-                        [('name','=',str(sheet.cell(row=rowNum, column=3).value)),('bom_id','=',bom.id)],limit=1
-                        ).filtered(lambda l:str(sheet.cell(row=rowNum, column=1).value  in operations))
-                bom_line_obj.create({
-                    'bom_id': self._context.get('active_id'),
-                    'product_id': product.id,
-                    'product_qty': product_qty,
-                    'operation_id':operation_id and operation_id.id,
-                })
-
+        if self.background:
+            return self._queue_import(bom)
+        stats = self._import_file(base64.b64decode(self.name), bom=bom)
+        self.msg = self._format_stats(stats)
+        return self._reopen_wizard()
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+from . import test_import_bom
+from . import test_import_bom_benchmark
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+import base64
+from io import BytesIO
+from unittest.mock import patch
+
+import openpyxl
+
+from odoo.exceptions import UserError
+from odoo.tests import TransactionCase, tagged
+
+
+def make_workbook(rows, header=("Product", "Quantity", "Operation"), sheets=None):
+    """Return the content of an xlsx file holding ``header`` and ``rows``, or
+    one sheet per item of the ``{title: rows}`` dict ``sheets``."""
+    wb = openpyxl.Workbook(write_only=True)
+    for title, sheet_rows in (sheets or {None: rows}).items():
+        sheet = wb.create_sheet(title)
+        sheet.append(header)
+        for row in sheet_rows:
+            sheet.append(row)
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+class ImportBomCase(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.finished_product = cls.env["product.product"].create(
+            {"name": "Finished product", "type": "product"}
+        )
+        cls.components = cls.env["product.product"].create(
+            [
+                {"name": "Component %s" % i, "default_code": "COMP-%05d" % i}
+                for i in range(20)
+            ]
+        )
+        cls.bom = cls.env["mrp.bom"].create(
+            {"product_tmpl_id": cls.finished_product.product_tmpl_id.id}
+        )
+
+    def _import(self, data, bom=None, **vals):
+        bom = bom or self.bom
+        vals["name"] = base64.b64encode(data)
+        wizard = (
+            self.env["wizard.import.bom"]
+            .with_context(active_id=bom.id, active_model="mrp.bom")
+            .create(vals)
+        )
+        wizard.import_bom()
+        return wizard
+
+
+@tagged("post_install", "-at_install")
+class TestImportBom(ImportBomCase):
+    def test_import_bom(self):
+        rows = [(comp.default_code, i + 1) for i, comp in enumerate(self.components)]
+        wizard = self._import(make_workbook(rows), chunk_size=7)
+        self.assertEqual(len(self.bom.bom_line_ids), 20)
+        self.assertEqual(
+            self.bom.bom_line_ids.mapped("product_qty"),
+            [float(i + 1) for i in range(20)],
+        )
+        self.assertTrue(wizard.msg)
+
+    def test_import_bom_not_streaming(self):
+        rows = [(comp.default_code, 2) for comp in self.components]
+        self._import(make_workbook(rows), streaming=False)
+        self.assertEqual(len(self.bom.bom_line_ids), 20)
+
+    def test_import_bom_delete_old_values(self):
+        data = make_workbook([(self.components[0].default_code, 1)])
+        self._import(data)
+        self._import(data, delete_old_values=True)
+        self.assertEqual(len(self.bom.bom_line_ids), 1)
+
+    def test_import_bom_missing_products(self):
+        rows = [("UNKNOWN-1", 1), (self.components[0].default_code, 1), ("UNKNOWN-2", 1)]
+        with self.assertRaisesRegex(UserError, "UNKNOWN-1, UNKNOWN-2"):
+            self._import(make_workbook(rows))
+        self.assertFalse(self.bom.bom_line_ids)
+
+    def test_import_bom_operations(self):
+        workcenter = self.env["mrp.workcenter"].create({"name": "Workcenter"})
+        operation = self.env["mrp.routing.workcenter"].create(
+            {"name": "Assembly", "workcenter_id": workcenter.id, "bom_id": self.bom.id}
+        )
+        rows = [
+            (self.components[0].default_code, 1, "Assembly"),
+            (self.components[1].default_code, 1, None),
+        ]
+        self._import(make_workbook(rows))
+        self.assertEqual(
+            self.bom.bom_line_ids.mapped("operation_id"), operation
+        )
+        rows = [
+            (self.components[0].default_code, 1, "Cutting"),
+            (self.components[1].default_code, 1, "Sewing"),
+        ]
+        with self.assertRaisesRegex(UserError, "Cutting, Sewing"):
+            self._import(make_workbook(rows))
+
+    def test_import_bom_sync_lines(self):
+        comps = self.components
+        self._import(make_workbook([(c.default_code, 1) for c in comps[:10]]))
+        lines = self.bom.bom_line_ids
+        kept = lines.filtered(lambda l: l.product_id in comps[1:10])
+        rows = [(c.default_code, 1) for c in comps[1:9]]
+        rows += [(comps[9].default_code, 5), (comps[10].default_code, 1)]
+        wizard = self._import(make_workbook(rows), sync_lines=True)
+        self.assertIn("1 created, 1 updated, 1 deleted, 8 unchanged", wizard.msg)
+        self.assertEqual(len(self.bom.bom_line_ids), 10)
+        # lines still present in the file are kept, not recreated
+        self.assertEqual(kept.exists(), kept)
+        self.assertEqual(
+            self.bom.bom_line_ids.filtered(
+                lambda l: l.product_id == comps[9]
+            ).product_qty,
+            5,
+        )
+        self.assertFalse(self.bom.bom_line_ids.filtered(lambda l: l.product_id == comps[0]))
+
+    def test_import_bom_multi_bom_sheets(self):
+        new_product = self.env["product.product"].create(
+            {"name": "New finished product", "default_code": "FIN-NEW"}
+        )
+        self.finished_product.default_code = "FIN-OLD"
+        comps = self.components
+        data = make_workbook(
+            None,
+            sheets={
+                "FIN-OLD": [(c.default_code, 1) for c in comps[:3]],
+                "FIN-NEW": [(c.default_code, 2) for c in comps[3:5]],
+            },
+        )
+        wizard = self._import(data, multi_bom="sheet", chunk_size=4)
+        self.assertIn("2 bills of materials", wizard.msg)
+        self.assertEqual(self.bom.bom_line_ids.product_id, comps[:3])
+        new_bom = self.env["mrp.bom"].search(
+            [("product_tmpl_id", "=", new_product.product_tmpl_id.id)]
+        )
+        self.assertEqual(len(new_bom), 1)
+        self.assertEqual(new_bom.bom_line_ids.product_id, comps[3:5])
+        self.assertEqual(new_bom.bom_line_ids.mapped("product_qty"), [2.0, 2.0])
+
+    def test_import_bom_multi_bom_sheets_csv(self):
+        data = "Product;Quantity\n%s;1" % self.components[0].default_code
+        with self.assertRaisesRegex(UserError, "Only xlsx workbooks"):
+            self._import(data.encode("utf-8"), multi_bom="sheet")
+        self.assertFalse(self.bom.bom_line_ids)
+
+    def test_import_bom_multi_bom_column(self):
+        self.finished_product.default_code = "FIN-OLD"
+        comps = self.components
+        rows = [("FIN-OLD", c.default_code, 3) for c in comps[:4]]
+        self._import(
+            make_workbook(rows, header=("Parent", "Product", "Quantity")),
+            multi_bom="column",
+        )
+        self.assertEqual(self.bom.bom_line_ids.product_id, comps[:4])
+        self.assertEqual(self.bom.bom_line_ids.mapped("product_qty"), [3.0] * 4)
+
+    def test_import_bom_csv(self):
+        lines = ["Product;Quantity;Operation"]
+        lines += ["%s;%s;" % (c.default_code, i + 1) for i, c in enumerate(self.components)]
+        self._import("\n".join(lines).encode("utf-8"))
+        self.assertEqual(len(self.bom.bom_line_ids), 20)
+        self.assertEqual(
+            self.bom.bom_line_ids.mapped("product_qty"),
+            [float(i + 1) for i in range(20)],
+        )
+
+    def test_import_bom_unsupported_format(self):
+        xls = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + bytes(range(256))
+        with self.assertRaisesRegex(UserError, "Legacy .xls"):
+            self._import(xls)
+        with self.assertRaisesRegex(UserError, "Unsupported file format"):
+            self._import(b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR")
+        with self.assertRaisesRegex(UserError, "Unsupported file format"):
+            self._import("Product;Quantity\nCOMP-00000;1".encode("utf-16"))
+        self.assertFalse(self.bom.bom_line_ids)
+
+    def test_import_bom_dry_run(self):
+        comps = self.components
+        rows = [
+            (comps[0].default_code, 1),
+            ("UNKNOWN", 1),
+            (comps[1].default_code, "abc"),
+            (comps[2].default_code, -2),
+            (comps[3].default_code, 1, "Cutting"),
+            (comps[0].default_code, 3),
+        ]
+        wizard = self._import(make_workbook(rows), dry_run=True)
+        self.assertFalse(self.bom.bom_line_ids)
+        self.assertIn("5 problems found", wizard.msg)
+        for expected in (
+            "UNKNOWN is not in products",
+            "Row 4: abc is not a valid quantity",
+            "Row 5: the quantity -2.0 is negative",
+            "Cutting is not an operation",
+            "Row 2: %s appears 2 times" % comps[0].default_code,
+        ):
+            self.assertIn(expected, wizard.msg)
+        wizard = self._import(
+            make_workbook([(c.default_code, 1) for c in comps]), dry_run=True
+        )
+        self.assertIn("no problem found", wizard.msg)
+        self.assertFalse(self.bom.bom_line_ids)
+
+    def test_import_bom_background(self):
+        rows = [(comp.default_code, 1) for comp in self.components]
+        wizard = self.env["wizard.import.bom"].with_context(
+            active_id=self.bom.id
+        ).create(
+            {"name": base64.b64encode(make_workbook(rows)), "background": True, "chunk_size": 6}
+        )
+        action = wizard.import_bom()
+        log = self.env["bom.import.log"].browse(action["res_id"])
+        self.assertEqual(log.state, "queued")
+        self.assertFalse(self.bom.bom_line_ids)
+        log._cron_process_queue()
+        self.assertEqual(log.state, "done")
+        self.assertEqual(log.rows_done, 20)
+        self.assertEqual(len(self.bom.bom_line_ids), 20)
+
+    def test_import_bom_background_failure(self):
+        log = self.env["bom.import.log"].create(
+            {
+                "bom_id": self.bom.id,
+                "file": base64.b64encode(make_workbook([("UNKNOWN", 1)])),
+            }
+        )
+        log._run()
+        self.assertEqual(log.state, "failed")
+        self.assertIn("UNKNOWN", log.errors)
+
+    def test_import_bom_background_failure_mid_import(self):
+        comps = self.components
+        self._import(make_workbook([(comps[0].default_code, 5)]))
+        old_line = self.bom.bom_line_ids
+        log = self.env["bom.import.log"].create(
+            {
+                "bom_id": self.bom.id,
+                "file": base64.b64encode(
+                    make_workbook([(c.default_code, 1) for c in comps])
+                ),
+                "delete_old_values": True,
+                "chunk_size": 6,
+            }
+        )
+        BomLine = type(self.env["mrp.bom.line"])
+        create = BomLine.create
+        calls = []
+
+        def failing_create(self, vals_list):
+            calls.append(len(vals_list))
+            if len(calls) == 2:
+                raise ValueError("Import interrupted")
+            return create(self, vals_list)
+
+        with patch.object(BomLine, "create", failing_create):
+            log._run()
+        self.assertEqual(calls, [6, 6])
+        self.assertEqual(log.state, "failed")
+        self.assertEqual(log.rows_done, 0)
+        # nothing of the import is left: the old line is still there
+        self.assertEqual(self.bom.bom_line_ids, old_line)
+        log.action_requeue()
+        log._run()
+        self.assertEqual(log.state, "done")
+        self.assertEqual(log.rows_done, 20)
+        self.assertEqual(self.bom.bom_line_ids.product_id, comps)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import time
+import tracemalloc
+
+from odoo.tests import tagged
+
+from .test_import_bom import ImportBomCase, make_workbook
+
+_logger = logging.getLogger(__name__)
+
+SIZES = (1000, 10000, 100000)
+OPERATIONS = ("Cutting", "Sewing", "Ironing", "Packing")
+
+# What a phase may cost: seconds per 1000 rows, and SQL queries either in
+# total or per row. Set IMPORT_BOM_BENCHMARK_FACTOR to scale the time budgets
+# on slower machines.
+BUDGETS = {
+    "parse": {"seconds": 0.5, "queries": 0},
+    "products": {"seconds": 0.1, "queries": 3},
+    "operations": {"seconds": 0.05, "queries": 3},
+    "create": {"seconds": 2.0, "queries_per_row": 3},
+}
+
+
+@tagged("post_install", "-at_install", "-standard", "import_bom_benchmark")
+class TestImportBomBenchmark(ImportBomCase):
+    """Time each phase of the BoM import on synthetic files and count its
+    SQL queries, record its peak memory in a separate pass, and fail when a
+    phase goes over its budget. Run with ``--test-tags import_bom_benchmark``."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.components |= cls.env["product.product"].create(
+            [
+                {"name": "Component %s" % i, "default_code": "COMP-%05d" % i}
+                for i in range(len(cls.components), 500)
+            ]
+        )
+        cls.workcenter = cls.env["mrp.workcenter"].create({"name": "Workcenter"})
+
+    def _new_bom(self):
+        bom = self.env["mrp.bom"].create(
+            {"product_tmpl_id": self.finished_product.product_tmpl_id.id}
+        )
+        self.env["mrp.routing.workcenter"].create(
+            [
+                {"name": name, "workcenter_id": self.workcenter.id, "bom_id": bom.id}
+                for name in OPERATIONS
+            ]
+        )
+        return bom
+
+    def _make_rows(self, size, with_operations):
+        codes = self.components.mapped("default_code")
+        return [
+            (
+                codes[i % len(codes)],
+                i % 7 + 1,
+                OPERATIONS[i % len(OPERATIONS)] if with_operations else None,
+            )
+            for i in range(size)
+        ]
+
+    def _measure(self, func, *args):
+        """Call ``func`` and return its result with the elapsed seconds and
+        the number of SQL queries issued."""
+        queries = self.env.cr.sql_log_count
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        return result, {
+            "seconds": seconds,
+            "queries": self.env.cr.sql_log_count - queries,
+        }
+
+    def _peak_memory(self, func, *args):
+        """Call ``func`` again, apart from the timed calls so that tracing
+        does not slow them down, and return the peak of memory it
+        allocated."""
+        tracemalloc.start()
+        try:
+            func(*args)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def _check_budget(self, phase, size, stats):
+        budget = BUDGETS[phase]
+        factor = float(os.environ.get("IMPORT_BOM_BENCHMARK_FACTOR", 1))
+        self.assertLessEqual(
+            stats["seconds"],
+            budget["seconds"] * factor * size / 1000,
+            "%s of %s rows is over its time budget" % (phase, size),
+        )
+        max_queries = budget.get("queries", budget.get("queries_per_row", 0) * size)
+        self.assertLessEqual(
+            stats["queries"],
+            max_queries,
+            "%s of %s rows is over its query budget" % (phase, size),
+        )
+
+    def _benchmark(self, with_operations):
+        for size in SIZES:
+            with self.subTest(size=size):
+                bom = self._new_bom()
+                data = make_workbook(self._make_rows(size, with_operations))
+                wizard = self.env["wizard.import.bom"].create({"chunk_size": 1000})
+
+                def parse():
+                    return wizard._parse_rows(wizard._read_rows(data))
+
+                def create(bom, operation_index):
+                    wizard._create_lines(
+                        wizard._prepare_line_vals(
+                            bom, lines, product_index, operation_index
+                        )
+                    )
+                    self.env["mrp.bom.line"].flush()
+
+                results = {}
+                lines, results["parse"] = self._measure(parse)
+                codes = {line[1] for line in lines}
+                names = {line[3] for line in lines if line[3]}
+                product_index, results["products"] = self._measure(
+                    wizard._get_product_index, codes
+                )
+                operation_index, results["operations"] = self._measure(
+                    wizard._get_operation_index, bom, names
+                )
+                __, results["create"] = self._measure(create, bom, operation_index)
+                self.assertEqual(len(bom.bom_line_ids), size)
+                # then the peak memory of each phase, the lines being created
+                # in another BoM
+                results["parse"]["peak"] = self._peak_memory(parse)
+                results["products"]["peak"] = self._peak_memory(
+                    wizard._get_product_index, codes
+                )
+                peak_bom = self._new_bom()
+                results["operations"]["peak"] = self._peak_memory(
+                    wizard._get_operation_index, peak_bom, names
+                )
+                results["create"]["peak"] = self._peak_memory(
+                    create, peak_bom, wizard._get_operation_index(peak_bom, names)
+                )
+                for phase, stats in results.items():
+                    _logger.info(
+                        "BoM import, %s rows%s, %-10s %8.3fs %8.1f MiB %6s queries",
+                        size,
+                        " with operations" if with_operations else "",
+                        phase,
+                        stats["seconds"],
+                        stats["peak"] / 1024 / 1024,
+                        stats["queries"],
+                    )
+                for phase, stats in results.items():
+                    self._check_budget(phase, size, stats)
+
+    def test_benchmark_without_operations(self):
+        self._benchmark(with_operations=False)
+
+    def test_benchmark_with_operations(self):
+        self._benchmark(with_operations=True)
+
+    def test_benchmark_chunked_create(self):
+        """Compare one create call per line with the batched creation."""
+        rows = self._make_rows(2000, with_operations=False)
+        data = make_workbook(rows)
+        timings = {}
+        for chunk_size in (1, 1000):
+            start = time.perf_counter()
+            self._import(data, chunk_size=chunk_size, delete_old_values=True)
+            self.env["mrp.bom.line"].flush()
+            timings[chunk_size] = time.perf_counter() - start
+        _logger.info(
+            "BoM import of %s lines: %.2fs line by line, %.2fs in chunks "
+            "of 1000 (x%.1f)",
+            len(rows),
+            timings[1],
+            timings[1000],
+            timings[1] / (timings[1000] or 1),
+        )
+        self.assertEqual(len(self.bom.bom_line_ids), len(rows))
+        self.assertLess(timings[1000], timings[1])
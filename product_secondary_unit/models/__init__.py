@@ -2,3 +2,4 @@
 from . import product_second_unit
 from . import product_secondary_unit_mixin
 from . import product_template
+from . import uom_uom
@@ -1,6 +1,15 @@
 # Copyright 2018 Tecnativa - Sergio Teruel
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
-from odoo import api, fields, models
+from odoo import _, api, fields, models, tools
+from odoo.exceptions import UserError
+from odoo.osv import expression
+from odoo.tools.float_utils import float_round
+from odoo.tools.query import Query
+
+from ..transaction_cache import get_transaction_cache, invalidate_transaction_cache
+
+# name of the cache of the conversions, keyed by (secondary unit id, uom id)
+CONVERSION_CACHE = "product_secondary_unit.conversions"
 
 
 class ProductSecondaryUnit(models.Model):
@@ -39,6 +48,93 @@ class ProductSecondaryUnit(models.Model):
     )
     active = fields.Boolean(default=True)
 
+    def init(self):
+        tools.create_index(
+            self.env.cr,
+            "product_secondary_unit_code_product_tmpl_id_index",
+            self._table,
+            ["code", "product_tmpl_id"],
+        )
+        # trigram index for the ilike searches on names, when available
+        self.env.cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if self.env.cr.rowcount:
+            self.env.cr.execute(
+                "CREATE INDEX IF NOT EXISTS product_secondary_unit_name_trgm_index "
+                "ON %s USING gin (name gin_trgm_ops)" % self._table
+            )
+
+    def _get_conversion(self, uom):
+        """Return ``(factor, rounding, uom rounding)`` to convert quantities
+        between ``uom`` and this secondary unit: the factor is the product of
+        both factors, the roundings are the ones of the unit of measure of
+        the secondary unit and of ``uom``.
+
+        Values are cached for the current transaction.
+        """
+        cache = get_transaction_cache(self.env, CONVERSION_CACHE)
+        key = (self.id, uom.id)
+        if key not in cache:
+            cache[key] = (self.factor * uom.factor, self.uom_id.rounding, uom.rounding)
+        return cache[key]
+
+    @api.model
+    def convert_quantities(self, lines):
+        """Convert quantities between secondary units and the unit of measure
+        of their product.
+
+        :param lines: iterable of ``(unit id, quantity, direction)``, the
+            direction being ``"to_secondary"`` to convert a quantity in the
+            unit of measure of the product into the unit, or ``"to_primary"``
+            for the opposite
+        :return: the converted quantities, in the order of ``lines``, rounded
+            like the quantities of the documents using these units
+        """
+        lines = list(lines)
+        units = self.browse({line[0] for line in lines})
+        missing = units - units.exists()
+        if missing:
+            raise UserError(
+                _("Secondary units %s do not exist.")
+                % ", ".join(str(unit_id) for unit_id in missing.ids)
+            )
+        # read the factors and roundings of all the units and uoms at once
+        units.mapped("uom_id.rounding")
+        units.mapped("product_tmpl_id.uom_id.rounding")
+        conversions = {
+            unit.id: unit._get_conversion(unit.product_tmpl_id.uom_id) for unit in units
+        }
+        result = []
+        for unit_id, qty, direction in lines:
+            factor, rounding, uom_rounding = conversions[unit_id]
+            if direction == "to_secondary":
+                qty = float_round(qty / (factor or 1.0), precision_rounding=rounding)
+            elif direction == "to_primary":
+                qty = float_round(qty * factor, precision_rounding=uom_rounding)
+            else:
+                raise UserError(_("Unknown conversion direction %s.") % direction)
+            result.append(qty)
+        return result
+
+    @api.model
+    def _invalidate_conversion_cache(self):
+        invalidate_transaction_cache(self.env, CONVERSION_CACHE)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env["product.template"]._invalidate_default_unit_cache()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        res = super().write(vals)
+        if "factor" in vals or "uom_id" in vals:
+            self._invalidate_conversion_cache()
+        self.env["product.template"]._invalidate_default_unit_cache()
+        return res
+
+    def unlink(self):
+        self.env["product.template"]._invalidate_default_unit_cache()
+        return super().unlink()
+
     def name_get(self):
         result = []
         for unit in self:
@@ -53,12 +149,31 @@ class ProductSecondaryUnit(models.Model):
         return result
 
     @api.model
-    def name_search(self, name="", args=None, operator="ilike", limit=100):
-        if args is None:
-            args = []
-        units = self.search([("code", "=", name)] + args, limit=1)
-        if not units:
-            return super(ProductSecondaryUnit, self).name_search(
-                name=name, args=args, operator=operator, limit=limit
+    def _name_search(
+        self, name, args=None, operator="ilike", limit=100, name_get_uid=None
+    ):
+        """Search the units whose code is ``name`` or whose name matches it in
+        a single query, the units with that code first."""
+        if not name or operator in expression.NEGATIVE_TERM_OPERATORS:
+            return super()._name_search(
+                name,
+                args=args,
+                operator=operator,
+                limit=limit,
+                name_get_uid=name_get_uid,
             )
-        return units.name_get()
+        domain = expression.AND(
+            [args or [], ["|", ("code", "=", name), ("name", operator, name)]]
+        )
+        query = self._search(domain, access_rights_uid=name_get_uid)
+        if not isinstance(query, Query):
+            return query
+        subquery, params = query.subselect()
+        self.env.cr.execute(
+            'SELECT "id" FROM "{table}" WHERE "id" IN ({subquery}) '
+            'ORDER BY ("code" = %s) IS TRUE DESC, {order} LIMIT %s'.format(
+                table=self._table, subquery=subquery, order=self._order
+            ),
+            params + [name, limit],
+        )
+        return [row[0] for row in self.env.cr.fetchall()]
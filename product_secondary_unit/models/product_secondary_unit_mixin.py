@@ -1,8 +1,25 @@
 # Copyright 2021 Tecnativa - Sergio Teruel
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from collections import defaultdict, namedtuple
+
 from odoo import api, fields, models
 from odoo.tools.float_utils import float_round
 
+from ..profiling import profiled
+from ..transaction_cache import get_transaction_cache
+
+# Conversion plan entry of a unit level: the unit and quantity fields of the
+# level, and the quantity and unit of measure fields of the model it converts
+# from (``None`` when the model does not use the level).
+UnitLevel = namedtuple(
+    "UnitLevel", ["unit_field", "qty_field", "target_qty_field", "target_uom_field"]
+)
+
+# Transaction cache of the unit and quantity fields modified on the records of
+# the mixin since their pending unit computations started, keyed by
+# (model name, record id)
+TOUCHED_CACHE = "product_secondary_unit.touched"
+
 
 class ProductSecondaryUnitMixin(models.AbstractModel):
     """
@@ -24,6 +41,16 @@ class ProductSecondaryUnitMixin(models.AbstractModel):
     you must add an onchange method on uom field and call to
     ``self._onchange_helper_product_uom_for_secondary()``
 
+    The third and fourth units are configured the same way with
+    ``_third_unit_fields`` and ``_fourth_unit_fields``. All the unit levels are
+    described in the ``_unit_levels`` table: supporting one more level takes
+    its two fields, their compute method and one more row in that table.
+
+    Each level has its own compute method and dependencies, and the
+    quantities of a record are only recomputed when the fields modified on it
+    can change them: writing the quantity of a level that does not drive the
+    target quantity does not recompute the other levels.
+
     You can see an example in ``purchase_order_secondary_unit`` on purchase-workflow
     repository.
     """
@@ -33,6 +60,13 @@ class ProductSecondaryUnitMixin(models.AbstractModel):
     _secondary_unit_fields = {}
     _third_unit_fields = {}
     _fourth_unit_fields = {}
+    # (unit field, quantity field, attribute holding the fields of the model
+    # the level converts from) for each unit level, in order
+    _unit_levels = (
+        ("secondary_uom_id", "secondary_uom_qty", "_secondary_unit_fields"),
+        ("third_uom_id", "third_uom_qty", "_third_unit_fields"),
+        ("fourth_uom_id", "fourth_uom_qty", "_fourth_unit_fields"),
+    )
 
     @api.model
     def _get_default_secondary_uom(self):
@@ -66,7 +100,7 @@ class ProductSecondaryUnitMixin(models.AbstractModel):
         digits="Product Unit of Measure",
         store=True,
         readonly=False,
-        compute="_compute_secondary_uom_qty",
+        compute="_compute_third_uom_qty",
         default="1",
     )
     third_uom_id = fields.Many2one(
@@ -77,11 +111,11 @@ class ProductSecondaryUnitMixin(models.AbstractModel):
     )
 
     fourth_uom_qty = fields.Float(
-        string="Third Qty",
+        string="Fourth Qty",
         digits="Product Unit of Measure",
         store=True,
         readonly=False,
-        compute="_compute_secondary_uom_qty",
+        compute="_compute_fourth_uom_qty",
         default="1",
     )
     fourth_uom_id = fields.Many2one(
@@ -91,185 +125,302 @@ class ProductSecondaryUnitMixin(models.AbstractModel):
         default=_get_default_fourth_uom,
     )
 
-    def _get_uom_line(self,x):
-        if x==2:
-            return self[self._secondary_unit_fields["uom_field"]]
-        if x==3:
-            return self[self._third_unit_fields["uom_field"]]
-        if x==4:
-            return self[self._fourth_unit_fields["uom_field"]]
-    def _get_factor_line(self,uom,x):
-        return uom.factor * self._get_uom_line(x).factor
-
-    def _get_quantity_from_line(self,x):
-        if x==2:
-            return self[self._secondary_unit_fields["qty_field"]]
-        if x==3:
-            return self[self._third_unit_fields["qty_field"]]
-        if x==4:
-            return self[self._fourth_unit_fields["qty_field"]]
+    @api.model
+    def _get_unit_plan(self):
+        """Return the conversion plan of the model, a tuple of ``UnitLevel``
+        aligned on ``_unit_levels``. The plan is built once per model class,
+        that is once per registry load."""
+        cls = type(self)
+        plan = cls.__dict__.get("_unit_plan")
+        if plan is None:
+            plan = []
+            for unit_field, qty_field, fields_attr in cls._unit_levels:
+                level_fields = getattr(cls, fields_attr) or {}
+                plan.append(
+                    UnitLevel(
+                        unit_field,
+                        qty_field,
+                        level_fields.get("qty_field"),
+                        level_fields.get("uom_field"),
+                    )
+                )
+            plan = cls._unit_plan = tuple(plan)
+        return plan
+
+    @api.model
+    def _prepare_default_units(self, vals_list, product_field="product_id"):
+        """Set in ``vals_list`` the units set as defaults on the template of
+        the product of the values not giving them, resolved for the whole
+        batch at once, with their quantities converted from the target
+        quantity of the values. Products without configured defaults, and
+        levels driving a target quantity that is not given, keep no unit."""
+        plan = self._get_unit_plan()
+        todo = [
+            vals
+            for vals in vals_list
+            if vals.get(product_field)
+            and any(
+                level.unit_field not in vals
+                and (not level.target_qty_field or level.target_qty_field in vals)
+                for level in plan
+            )
+        ]
+        if not todo:
+            return
+        products = self.env["product.product"].browse(
+            {vals[product_field] for vals in todo}
+        )
+        default_units = products.product_tmpl_id._get_default_units(fallback=False)
+        units = self.env["product.secondary.unit"].browse(
+            {
+                unit_id
+                for unit_ids in default_units.values()
+                for unit_id in unit_ids
+                if unit_id
+            }
+        )
+        uoms = self.env["uom.uom"].browse(
+            {
+                vals[level.target_uom_field]
+                for vals in todo
+                for level in plan
+                if level.target_uom_field and vals.get(level.target_uom_field)
+            }
+        )
+        # read the factors and roundings of the units and uoms at once
+        units.mapped("uom_id.rounding")
+        (uoms | products.uom_id).mapped("factor")
+        for vals in todo:
+            product = products.browse(vals[product_field])
+            unit_ids = default_units[product.product_tmpl_id.id]
+            for level, unit_id in zip(plan, unit_ids):
+                if not unit_id or level.unit_field in vals:
+                    continue
+                if level.target_qty_field and level.target_qty_field not in vals:
+                    continue
+                unit = units.browse(unit_id)
+                vals[level.unit_field] = unit_id
+                if (
+                    not level.target_qty_field
+                    or level.qty_field in vals
+                    or unit.dependency_type == "independent"
+                ):
+                    continue
+                uom = uoms.browse(vals.get(level.target_uom_field)) or product.uom_id
+                factor, rounding, __ = unit._get_conversion(uom)
+                vals[level.qty_field] = float_round(
+                    vals[level.target_qty_field] / (factor or 1.0),
+                    precision_rounding=rounding,
+                )
+
+    def _get_uom_line(self, x):
+        return self[self._get_unit_plan()[x - 2].target_uom_field]
+
+    def _get_factor_line(self, uom, x):
+        return uom._get_conversion(self._get_uom_line(x))[0]
+
+    def _get_quantity_from_line(self, x):
+        return self[self._get_unit_plan()[x - 2].target_qty_field]
 
     @api.model
     def _get_secondary_uom_qty_depends(self):
-        if not self._secondary_unit_fields:
-            return []
-        return [self._secondary_unit_fields["qty_field"]]
+        return list(
+            {level.target_qty_field for level in self._get_unit_plan() if level.target_qty_field}
+        )
 
     @api.model
-    def _get_third_uom_qty_depends(self):
-        if not self._third_unit_fields:
-            return []
-        return [self._third_unit_fields["qty_field"]]
+    def _get_unit_qty_depends(self, index):
+        """Return the dependencies of the quantity of the unit level at
+        ``index`` in the plan."""
+        level = self._get_unit_plan()[index]
+        return [level.target_qty_field] if level.target_qty_field else []
 
     @api.model
-    def _get_fourth_uom_qty_depends(self):
-        if not self._fourth_unit_fields:
-            return []
-        return [self._fourth_unit_fields["qty_field"]]
+    def _get_target_qty_depends(self, target):
+        """Return the dependencies of the target quantity field ``target``
+        computed with ``_compute_helper_target_field_qty``."""
+        return [
+            fname
+            for level in self._get_unit_plan()
+            if level.target_qty_field == target
+            for fname in (level.unit_field, level.qty_field)
+        ]
 
-    @api.depends(lambda x: x._get_secondary_uom_qty_depends() and x._get_third_uom_qty_depends() and x._get_fourth_uom_qty_depends())
-    def _compute_secondary_uom_qty(self):
-        for line in self:
-            if not line.secondary_uom_id:
-                line.secondary_uom_qty = 0.0
-                continue
-            elif line.secondary_uom_id.dependency_type == "independent":
-                continue
-            factor = line._get_factor_line(line.secondary_uom_id,2)
-            qty_line = line._get_quantity_from_line(2)
-            qty = float_round(
-                qty_line / (factor or 1.0),
-                precision_rounding=line.secondary_uom_id.uom_id.rounding,
-            )
-            line.third_uom_qty = qty
-            if not line.third_uom_id:
-                line.third_uom_qty = 0.0
-                continue
-            elif line.third_uom_id.dependency_type == "independent":
+    def modified(self, fnames, create=False, before=False):
+        if not before:
+            plan = self._get_unit_plan()
+            tracked = {
+                fname
+                for level in plan
+                for fname in (level.unit_field, level.qty_field, level.target_qty_field)
+                if fname
+            }
+            touched = tracked.intersection(fnames)
+            if touched:
+                self._record_unit_touched(touched)
+        return super().modified(fnames, create=create, before=before)
+
+    def _get_unit_computed_fields(self):
+        """Return the computed quantity fields of the unit plan."""
+        return [
+            self._fields[fname]
+            for level in self._get_unit_plan()
+            for fname in (level.qty_field, level.target_qty_field)
+            if fname and self._fields[fname].compute
+        ]
+
+    def _record_unit_touched(self, fnames):
+        """Record that ``fnames`` were modified on the records of ``self``.
+        They are added to the fields already recorded while the unit
+        computations of a record are pending, and replace them otherwise."""
+        cache = get_transaction_cache(self.env, TOUCHED_CACHE)
+        tocompute = self.env.all.tocompute
+        computed = self._get_unit_computed_fields()
+        for record_id in self._ids:
+            if not isinstance(record_id, int):
                 continue
-            factor = line._get_factor_line(line.third_uom_id,3)
-            qty_line = line._get_quantity_from_line(3)
-            qty = float_round(
-                qty_line / (factor or 1.0),
-                precision_rounding=line.third_uom_id.uom_id.rounding,
-            )
-            line.third_uom_qty = qty
-            if not line.fourth_uom_id:
-                line.third_uom_qty = 0.0
+            key = (self._name, record_id)
+            if key in cache and any(record_id in tocompute.get(f, ()) for f in computed):
+                cache[key].update(fnames)
+            else:
+                cache[key] = set(fnames)
+
+    def _get_unit_touched(self):
+        """Return the unit and quantity fields modified on the record, or
+        None when they are unknown."""
+        if not isinstance(self.id, int):
+            return None
+        cache = get_transaction_cache(self.env, TOUCHED_CACHE)
+        return cache.get((self._name, self.id))
+
+    def _release_unit_touched(self):
+        """Forget the fields modified on the records of ``self`` whose unit
+        computations are all done."""
+        cache = get_transaction_cache(self.env, TOUCHED_CACHE)
+        if not cache:
+            return
+        tocompute = self.env.all.tocompute
+        computed = self._get_unit_computed_fields()
+        for record_id in self._ids:
+            if not any(record_id in tocompute.get(f, ()) for f in computed):
+                cache.pop((self._name, record_id), None)
+
+    def _unit_target_may_change(self, target, touched):
+        """Return whether the target quantity field ``target`` of the record
+        may change after the modification of the fields ``touched``: when it
+        was written, or when a level up to the one driving it was."""
+        if touched is None or target in touched:
+            return True
+        for level in self._get_unit_plan():
+            if level.target_qty_field != target:
                 continue
-            elif line.fourth_uom_id.dependency_type == "independent":
+            if level.unit_field in touched or level.qty_field in touched:
+                return True
+            if self[level.unit_field]:
+                return False
+        return True
+
+    def _assign_grouped(self, fname, values):
+        """Assign ``values``, aligned on the records of ``self``, to the field
+        ``fname`` with a single assignment per distinct value."""
+        ids_by_value = defaultdict(list)
+        for record, value in zip(self, values):
+            ids_by_value[value].append(record.id)
+        for value, ids in ids_by_value.items():
+            self.browse(ids)[fname] = value
+
+    def _compute_unit_qty(self, index):
+        """Compute the quantity of the unit level at ``index`` in the plan for
+        the whole recordset, assigning the results back in bulk. Records
+        whose modified fields cannot change it keep their quantity."""
+        level = self._get_unit_plan()[index]
+        ids = []
+        values = []
+        for line in self:
+            unit = line[level.unit_field]
+            if not unit:
+                qty = 0.0
+            elif not level.target_qty_field or unit.dependency_type == "independent":
                 continue
-            factor = line._get_factor_line(line.fourth_uom_id,4)
-            qty_line = line._get_quantity_from_line(4)
-            qty = float_round(
-                qty_line / (factor or 1.0),
-                precision_rounding=line.fourth_uom_id.uom_id.rounding,
-            )
-            line.fourth_uom_qty = qty
+            else:
+                touched = line._get_unit_touched()
+                if (
+                    touched is not None
+                    and level.unit_field not in touched
+                    and not line._unit_target_may_change(level.target_qty_field, touched)
+                ):
+                    continue
+                factor, rounding, __ = unit._get_conversion(line[level.target_uom_field])
+                qty = float_round(
+                    line[level.target_qty_field] / (factor or 1.0),
+                    precision_rounding=rounding,
+                )
+            ids.append(line.id)
+            values.append(qty)
+        self.browse(ids)._assign_grouped(level.qty_field, values)
+        self._release_unit_touched()
 
+    @api.depends(lambda x: x._get_unit_qty_depends(0))
+    @profiled
+    def _compute_secondary_uom_qty(self):
+        self._compute_unit_qty(0)
+
+    @api.depends(lambda x: x._get_unit_qty_depends(1))
+    @profiled
+    def _compute_third_uom_qty(self):
+        self._compute_unit_qty(1)
 
+    @api.depends(lambda x: x._get_unit_qty_depends(2))
+    @profiled
+    def _compute_fourth_uom_qty(self):
+        self._compute_unit_qty(2)
+
+    @profiled
     def _compute_helper_target_field_qty(self):
-        """Set the target qty field defined in model"""
+        """Set the target qty field defined in model from the first unit level
+        converting into it that has a unit. Records keep their target
+        quantity when none of the fields that drive it was modified."""
+        levels_by_target = defaultdict(list)
+        for level in self._get_unit_plan():
+            if level.target_qty_field:
+                levels_by_target[level.target_qty_field].append(level)
         for rec in self:
-            if not rec.secondary_uom_id:
-                rec[rec._secondary_unit_fields["qty_field"]] = rec._origin[
-                    rec._secondary_unit_fields["qty_field"]
-                ]
-                continue
-            if rec.secondary_uom_id.dependency_type == "independent":
-                if rec[rec._secondary_unit_fields["qty_field"]] == 0.0:
-                    rec[rec._secondary_unit_fields["qty_field"]] = 1.0
-                continue
-            # To avoid recompute secondary_uom_qty field when
-            # secondary_uom_id changes.
-            rec.env.remove_to_compute(
-                field=rec._fields["secondary_uom_qty"], records=rec
-            )
-            factor = rec._get_factor_line(rec.secondary_uom_id,2)
-            qty = float_round(
-                rec.secondary_uom_qty * factor,
-                precision_rounding=rec._get_uom_line(2).rounding,
-            )
-            rec[rec._secondary_unit_fields["qty_field"]] = qty
-
-            if not rec.third_uom_id:
-                rec[rec._third_unit_fields["qty_field"]] = rec._origin[
-                    rec._third_unit_fields["qty_field"]
-                ]
-                continue
-            if rec.third_uom_id.dependency_type == "independent":
-                if rec[rec._third_unit_fields["qty_field"]] == 0.0:
-                    rec[rec._third_unit_fields["qty_field"]] = 1.0
-                continue
-                # To avoid recompute secondary_uom_qty field when
-                # secondary_uom_id changes.
-            rec.env.remove_to_compute(
-                field=rec._fields["third_uom_qty"], records=rec
-            )
-            factor = rec._get_factor_line(rec.third_uom_id,3)
-            qty = float_round(
-                rec.third_uom_qty * factor,
-                precision_rounding=rec._get_uom_line(3).rounding,
-            )
-            rec[rec._third_unit_fields["qty_field"]] = qty
-            if not rec.fourth_uom_id:
-                rec[rec._fourth_unit_fields["qty_field"]] = rec._origin[
-                    rec._fourth_unit_fields["qty_field"]
-                ]
-                continue
-            if rec.fourth_uom_id.dependency_type == "independent":
-                if rec[rec._fourth_unit_fields["qty_field"]] == 0.0:
-                    rec[rec._fourth_unit_fields["qty_field"]] = 1.0
-                continue
-                # To avoid recompute secondary_uom_qty field when
-                # secondary_uom_id changes.
-            rec.env.remove_to_compute(
-                field=rec._fields["fourth_uom_qty"], records=rec
-            )
-            factor = rec._get_factor_line(rec.fourth_uom_id, 4)
-            qty = float_round(
-                rec.third_uom_qty * factor,
-                precision_rounding=rec._get_uom_line(3).rounding,
-            )
-            rec[rec._third_unit_fields["qty_field"]] = qty
+            touched = rec._get_unit_touched()
+            for target, levels in levels_by_target.items():
+                if not rec._unit_target_may_change(target, touched):
+                    continue
+                level = next((level for level in levels if rec[level.unit_field]), None)
+                if not level:
+                    rec[target] = rec._origin[target]
+                    continue
+                unit = rec[level.unit_field]
+                if unit.dependency_type == "independent":
+                    if rec[target] == 0.0:
+                        rec[target] = 1.0
+                    continue
+                # To avoid recompute the quantity of the level when its unit
+                # changes.
+                rec.env.remove_to_compute(field=rec._fields[level.qty_field], records=rec)
+                factor, __, rounding = unit._get_conversion(rec[level.target_uom_field])
+                rec[target] = float_round(
+                    rec[level.qty_field] * factor, precision_rounding=rounding
+                )
+        self._release_unit_touched()
 
+    @profiled
     def _onchange_helper_product_uom_for_secondary(self):
         """Helper method to be called from onchange method of uom field in
         target model.
         """
-        if not self.secondary_uom_id:
-            self.secondary_uom_qty = 0.0
-            return
-        elif self.secondary_uom_id.dependency_type == "independent":
-            return
-        factor = self._get_factor_line(self.secondary_uom_id,2)
-        line_qty = self._get_quantity_from_line(2)
-        qty = float_round(
-            line_qty / (factor or 1.0),
-            precision_rounding=self._get_uom_line(2).rounding,
-        )
-        self.secondary_uom_qty = qty
-        if not self.third_uom_id:
-            self.third_uom_qty = 0.0
-            return
-        elif self.third_uom_id.dependency_type == "independent":
-            return
-        factor = self._get_factor_line(self.third_uom_id,3)
-        line_qty = self._get_quantity_from_line(3)
-        qty = float_round(
-            line_qty / (factor or 1.0),
-            precision_rounding=self._get_uom_line().rounding,
-        )
-        self.third_uom_qty = qty
-        if not self.fourth_uom_id:
-            self.fourth_uom_qty = 0.0
-            return
-        elif self.fourth_uom_id.dependency_type == "independent":
-            return
-        factor = self._get_factor_line(self.fourth_uom_id,4)
-        line_qty = self._get_quantity_from_line(4)
-        qty = float_round(
-            line_qty / (factor or 1.0),
-            precision_rounding=self._get_uom_line(4).rounding,
-        )
-        self.fourth_uom_qty = qty
\ No newline at end of file
+        for level in self._get_unit_plan():
+            unit = self[level.unit_field]
+            if not unit:
+                self[level.qty_field] = 0.0
+                continue
+            elif not level.target_qty_field or unit.dependency_type == "independent":
+                continue
+            factor, __, rounding = unit._get_conversion(self[level.target_uom_field])
+            self[level.qty_field] = float_round(
+                self[level.target_qty_field] / (factor or 1.0),
+                precision_rounding=rounding,
+            )
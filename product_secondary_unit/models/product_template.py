@@ -2,10 +2,23 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 from odoo import api, fields, models
 
+from ..transaction_cache import get_transaction_cache, invalidate_transaction_cache
+
+# name of the cache of the default unit ids, keyed by template id
+DEFAULT_UNIT_CACHE = "product_secondary_unit.default_units"
+
 
 class ProductTemplate(models.Model):
     _inherit = "product.template"
 
+    # default unit field of each unit level, in the order of the levels of
+    # product.secondary.unit.mixin
+    _default_unit_fields = (
+        "default_secondary_uom_id",
+        "default_third_uom_id",
+        "default_fourth_uom_id",
+    )
+
     secondary_uom_ids = fields.One2many(
         comodel_name="product.secondary.unit",
         inverse_name="product_tmpl_id",
@@ -13,27 +26,94 @@ class ProductTemplate(models.Model):
         help="Default Secondary Unit of Measure.",
         context={"active_test": False},
     )
+    default_secondary_uom_id = fields.Many2one(
+        comodel_name="product.secondary.unit",
+        string="Default second unit",
+        domain="[('product_tmpl_id', '=', id)]",
+        help="Second unit set on new documents of the product. When empty, "
+        "the first secondary unit of the product is used.",
+    )
+    default_third_uom_id = fields.Many2one(
+        comodel_name="product.secondary.unit",
+        string="Default third unit",
+        domain="[('product_tmpl_id', '=', id)]",
+        help="Third unit set on new documents of the product.",
+    )
+    default_fourth_uom_id = fields.Many2one(
+        comodel_name="product.secondary.unit",
+        string="Default fourth unit",
+        domain="[('product_tmpl_id', '=', id)]",
+        help="Fourth unit set on new documents of the product.",
+    )
+
+    def _get_default_units(self, fallback=True):
+        """Return ``{template id: (2nd unit id, 3rd unit id, 4th unit id)}``
+        with the default units of the templates of ``self``, or False for
+        the levels without one. Without ``fallback``, only the units set
+        as defaults on the templates are returned, and the second unit does
+        not fall back to the first unit of the template.
+
+        Values are cached for the current transaction, and the missing ones
+        are read for all the templates of ``self`` at once.
+        """
+        cache = get_transaction_cache(self.env, DEFAULT_UNIT_CACHE)
+        missing = [tmpl_id for tmpl_id in self._origin.ids if tmpl_id not in cache]
+        if missing:
+            first_units = {}
+            for unit in (
+                self.env["product.secondary.unit"]
+                .with_context(active_test=False)
+                .search_read(
+                    [("product_tmpl_id", "in", missing)],
+                    ["product_tmpl_id"],
+                    order="id",
+                )
+            ):
+                first_units.setdefault(unit["product_tmpl_id"][0], unit["id"])
+            for row in self.browse(missing).read(
+                list(self._default_unit_fields), load=False
+            ):
+                unit_ids = tuple(row[fname] for fname in self._default_unit_fields)
+                cache[row["id"]] = (unit_ids, first_units.get(row["id"], False))
+        result = {}
+        for tmpl_id in self._origin.ids:
+            unit_ids, first_unit_id = cache[tmpl_id]
+            if fallback and not unit_ids[0]:
+                # the first unit remains the default second unit
+                unit_ids = (first_unit_id,) + unit_ids[1:]
+            result[tmpl_id] = unit_ids
+        return result
+
+    @api.model
+    def _invalidate_default_unit_cache(self):
+        invalidate_transaction_cache(self.env, DEFAULT_UNIT_CACHE)
+
+    def _get_default_unit(self, level):
+        template = self[:1]
+        if not template:
+            return self.env["product.secondary.unit"]
+        if not template._origin:
+            # not saved yet, nothing to cache
+            unit = template[self._default_unit_fields[level]]
+            if not level and not unit:
+                unit = template.secondary_uom_ids[:1]
+            return unit
+        unit_ids = template._get_default_units()[template._origin.id]
+        return self.env["product.secondary.unit"].browse(unit_ids[level])
 
     @api.model
     def _get_default_secondary_uom(self):
-        return (
-            self.secondary_uom_ids
-            and self.secondary_uom_ids[0]
-            or self.secondary_uom_ids
-        )
+        return self._get_default_unit(0)
 
     @api.model
     def _get_default_third_uom(self):
-        return (
-                self.secondary_uom_ids
-                and self.secondary_uom_ids[0]
-                or self.secondary_uom_ids
-        )
+        return self._get_default_unit(1)
 
     @api.model
     def _get_default_fourth_uom(self):
-        return (
-                self.secondary_uom_ids
-                and self.secondary_uom_ids[0]
-                or self.secondary_uom_ids
-        )
+        return self._get_default_unit(2)
+
+    def write(self, vals):
+        if any(fname in vals for fname in self._default_unit_fields):
+            self._invalidate_default_unit_cache()
+        return super().write(vals)
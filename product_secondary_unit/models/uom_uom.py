@@ -0,0 +1,12 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import models
+
+
+class UoM(models.Model):
+    _inherit = "uom.uom"
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {"factor", "factor_inv", "uom_type", "rounding"} & set(vals):
+            self.env["product.secondary.unit"]._invalidate_conversion_cache()
+        return res
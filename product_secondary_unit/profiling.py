@@ -0,0 +1,129 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Opt-in counters of the secondary unit machinery.
+
+Methods decorated with :func:`profiled` count their calls, the records they
+process, the SQL queries they issue and the time they take, per model and
+method, when the system parameter ``product_secondary_unit.profiling`` is set
+or the context key ``secondary_unit_profiling`` is true. The counters of a
+transaction are logged in a single line when it ends, and :func:`measure`
+gives what an operation costs to benchmarks.
+"""
+import functools
+import logging
+import time
+
+from odoo import models
+
+_logger = logging.getLogger(__name__)
+
+PARAMETER = "product_secondary_unit.profiling"
+CONTEXT_KEY = "secondary_unit_profiling"
+DATA_KEY = "product_secondary_unit.profiling"
+
+
+def profiling_enabled(env):
+    if env.context.get(CONTEXT_KEY):
+        return True
+    return bool(env["ir.config_parameter"].sudo().get_param(PARAMETER))
+
+
+def get_counters(cr):
+    """Return the counters of the current transaction of ``cr``, as a dict
+    ``{(model, method): {"calls", "records", "queries", "seconds"}}``."""
+    return cr.postcommit.data.get(DATA_KEY, {})
+
+
+def _log_counters(counters):
+    if not counters:
+        return
+    _logger.info(
+        "Secondary units: %s",
+        "; ".join(
+            "%s.%s %d calls, %d records, %d queries, %.3fs"
+            % (
+                model,
+                method,
+                values["calls"],
+                values["records"],
+                values["queries"],
+                values["seconds"],
+            )
+            for (model, method), values in sorted(counters.items())
+        ),
+    )
+
+
+def _record(records, method, count, queries, seconds):
+    cr = records.env.cr
+    counters = cr.postcommit.data.get(DATA_KEY)
+    if counters is None:
+        counters = cr.postcommit.data[DATA_KEY] = {}
+        callback = functools.partial(_log_counters, counters)
+        cr.postcommit.add(callback)
+        cr.postrollback.add(callback)
+    values = counters.setdefault(
+        (records._name, method),
+        {"calls": 0, "records": 0, "queries": 0, "seconds": 0.0},
+    )
+    values["calls"] += 1
+    values["records"] += count
+    values["queries"] += queries
+    values["seconds"] += seconds
+
+
+def profiled(method):
+    """Decorate ``method`` to count its calls when profiling is enabled. The
+    records counted are the ones of ``self``, or the returned ones for
+    model methods such as ``create``."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not profiling_enabled(self.env):
+            return method(self, *args, **kwargs)
+        cr = self.env.cr
+        queries = cr.sql_log_count
+        start = time.perf_counter()
+        result = method(self, *args, **kwargs)
+        count = len(self)
+        if not count and isinstance(result, models.BaseModel):
+            count = len(result)
+        _record(
+            self,
+            method.__name__,
+            count,
+            cr.sql_log_count - queries,
+            time.perf_counter() - start,
+        )
+        return result
+
+    return wrapper
+
+
+def count_records(cr, model_names, prefix="_compute"):
+    """Return the number of records processed in the current transaction of
+    ``cr`` by the profiled methods of ``model_names`` starting with
+    ``prefix``."""
+    return sum(
+        values["records"]
+        for (model, method), values in get_counters(cr).items()
+        if model in model_names and method.startswith(prefix)
+    )
+
+
+def measure(env, func, model_names, *args):
+    """Call ``func`` with ``args`` and flush its pending writes, and return
+    its result with the elapsed seconds, the SQL queries issued and the
+    records processed by the unit computes of ``model_names``. The flush
+    runs with profiling enabled, so that the computes it triggers are
+    counted as well."""
+    cr = env.cr
+    queries = cr.sql_log_count
+    recomputes = count_records(cr, model_names)
+    start = time.perf_counter()
+    result = func(*args)
+    env["base"].with_context(**{CONTEXT_KEY: True}).flush()
+    return result, {
+        "seconds": time.perf_counter() - start,
+        "queries": cr.sql_log_count - queries,
+        "recomputes": count_records(cr, model_names) - recomputes,
+    }
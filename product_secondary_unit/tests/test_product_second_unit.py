@@ -1,5 +1,6 @@
 # Copyright 2018 Tecnativa - Sergio Teruel
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo.exceptions import UserError
 from odoo.tests import TransactionCase, tagged
 
 
@@ -58,3 +59,60 @@ class TestProductSecondaryUnit(TransactionCase):
         self.assertEqual(len(name_get), 1)
         name_get = self.env["product.secondary.unit"].name_search(name="X", args=args)
         self.assertEqual(len(name_get), 0)
+
+    def test_default_units(self):
+        units = self.product.secondary_uom_ids
+        self.assertEqual(self.product._get_default_secondary_uom(), units[0])
+        self.assertFalse(self.product._get_default_third_uom())
+        self.assertFalse(self.env["product.template"]._get_default_secondary_uom())
+        self.product.write(
+            {
+                "default_secondary_uom_id": units[1].id,
+                "default_third_uom_id": units[0].id,
+            }
+        )
+        self.assertEqual(
+            self.product._get_default_units(),
+            {self.product.id: (units[1].id, units[0].id, False)},
+        )
+        # the cached defaults follow the changes of the units
+        self.product.default_secondary_uom_id = False
+        self.assertEqual(self.product._get_default_secondary_uom(), units[0])
+        units[0].unlink()
+        self.assertEqual(self.product._get_default_secondary_uom(), units[1])
+        # only the configured defaults are set on new records
+        Mixin = self.env["product.secondary.unit.mixin"]
+        vals_list = [{"product_id": self.product.product_variant_id.id}]
+        Mixin._prepare_default_units(vals_list)
+        self.assertNotIn("secondary_uom_id", vals_list[0])
+        self.product.default_secondary_uom_id = units[1]
+        Mixin._prepare_default_units(vals_list)
+        self.assertEqual(vals_list[0]["secondary_uom_id"], units[1].id)
+        self.assertNotIn("third_uom_id", vals_list[0])
+
+    def test_product_secondary_unit_search_code_first(self):
+        units = self.product.secondary_uom_ids
+        units[1].code = "unit"
+        result = self.env["product.secondary.unit"].name_search(
+            name="unit", args=[("product_tmpl_id", "=", self.product.id)]
+        )
+        self.assertEqual([r[0] for r in result], [units[1].id, units[0].id])
+        result = self.env["product.secondary.unit"].name_search(
+            name="unit", args=[("product_tmpl_id", "=", self.product.id)], limit=1
+        )
+        self.assertEqual([r[0] for r in result], [units[1].id])
+
+    def test_convert_quantities(self):
+        units = self.product.secondary_uom_ids
+        result = self.env["product.secondary.unit"].convert_quantities(
+            [
+                (units[0].id, 7.0, "to_secondary"),
+                (units[1].id, 2.0, "to_primary"),
+                (units[0].id, 1.0, "to_secondary"),
+            ]
+        )
+        self.assertEqual(result, [10.0, 1.8, 1.43])
+        with self.assertRaises(UserError):
+            self.env["product.secondary.unit"].convert_quantities(
+                [(units[0].id, 1.0, "sideways")]
+            )
@@ -3,6 +3,9 @@
 from odoo_test_helper import FakeModelLoader
 
 from odoo.tests import SavepointCase
+from odoo.tools.float_utils import float_round
+
+from odoo.addons.product_secondary_unit import profiling
 
 
 class TestProductSecondaryUnitMixin(SavepointCase, FakeModelLoader):
@@ -129,3 +132,72 @@ class TestProductSecondaryUnitMixin(SavepointCase, FakeModelLoader):
         fake_model.write({"secondary_uom_qty": 4})
         self.assertEqual(fake_model.product_uom_qty, 17)
         self.assertEqual(fake_model.secondary_uom_qty, 4)
+
+    def test_batch_compute_matches_scalar(self):
+        uoms = self.product_uom_unit | self.product_uom_dozen
+        units = self.secondary_unit_box_5 | self.secondary_unit_box_10
+        fakes = self.env["secondary.unit.fake"].create(
+            [
+                {
+                    "name": "Fake %s-%s" % (uom.name, unit.name),
+                    "product_id": self.product_template.product_variant_ids.id,
+                    "product_uom_id": uom.id,
+                    "secondary_uom_id": unit.id,
+                }
+                for uom in uoms
+                for unit in units
+            ]
+        )
+        fakes.write({"product_uom_qty": 37.0})
+        for fake in fakes:
+            expected = float_round(
+                37.0 / fake._get_factor_line(fake.secondary_uom_id, 2),
+                precision_rounding=fake.secondary_uom_id.uom_id.rounding,
+            )
+            self.assertEqual(fake.secondary_uom_qty, expected)
+
+    def test_conversion_cache_invalidation(self):
+        fake_model = self.secondary_unit_fake
+        fake_model.write(
+            {"secondary_uom_qty": 2, "secondary_uom_id": self.secondary_unit_box_10.id}
+        )
+        fake_model.write({"product_uom_qty": 40.0})
+        self.assertEqual(fake_model.secondary_uom_qty, 4)
+        self.secondary_unit_box_10.factor = 20
+        fake_model.write({"product_uom_qty": 60.0})
+        self.assertEqual(fake_model.secondary_uom_qty, 3)
+        self.product_uom_unit.rounding = 0.5
+        fake_model.write({"product_uom_qty": 55.0})
+        self.assertEqual(fake_model.secondary_uom_qty, 3)
+
+    def test_conversion_cache_rollback(self):
+        unit = self.secondary_unit_box_10
+        with self.assertRaises(ValueError), self.env.cr.savepoint():
+            unit.factor = 20
+            self.assertEqual(unit._get_conversion(self.product_uom_unit)[0], 20)
+            raise ValueError()
+        # the values computed before the rollback are not served anymore
+        self.assertEqual(unit._get_conversion(self.product_uom_unit)[0], 10)
+
+    def test_profiling_counters(self):
+        key = ("secondary.unit.fake", "_compute_secondary_uom_qty")
+
+        def calls():
+            return profiling.get_counters(self.env.cr).get(key, {}).get("calls", 0)
+
+        fake_model = self.secondary_unit_fake
+        fake_model.write({"secondary_uom_id": self.secondary_unit_box_10.id})
+        fake_model.write({"product_uom_qty": 40.0})
+        self.assertEqual(fake_model.secondary_uom_qty, 4)
+        self.assertEqual(calls(), 0)
+        fake_model = fake_model.with_context(secondary_unit_profiling=True)
+        fake_model.write({"product_uom_qty": 60.0})
+        self.assertEqual(fake_model.secondary_uom_qty, 6)
+        self.assertEqual(calls(), 1)
+        counters = profiling.get_counters(self.env.cr)
+        self.assertEqual(counters[key]["records"], 1)
+        with self.assertLogs(profiling.__name__, "INFO") as logs:
+            profiling._log_counters(counters)
+        self.assertIn(
+            "secondary.unit.fake._compute_secondary_uom_qty 1 calls", logs.output[0]
+        )
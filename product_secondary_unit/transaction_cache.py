@@ -0,0 +1,19 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Caches scoped to the current database transaction.
+
+A cache is a dict stored in the data of the precommit hooks of the cursor,
+so it is dropped when the transaction is committed or rolled back, and when
+the cursor rolls back to a savepoint. Invalidating a cache replaces its dict
+instead of emptying it, so copies of the previous state of the hooks never
+hold values computed after the invalidation.
+"""
+
+
+def get_transaction_cache(env, key):
+    """Return the cache named ``key`` of the current transaction of ``env``."""
+    return env.cr.precommit.data.setdefault(key, {})
+
+
+def invalidate_transaction_cache(env, key):
+    """Drop the cache named ``key`` of the current transaction of ``env``."""
+    env.cr.precommit.data.pop(key, None)
@@ -13,9 +13,13 @@
     "installable": True,
     "depends": ["stock", "product_secondary_unit"],
     "data": [
+        "security/ir.model.access.csv",
+        "security/stock_secondary_unit_security.xml",
+        "data/ir_cron.xml",
         "views/product_views.xml",
         "views/stock_move_views.xml",
         "views/stock_picking_views.xml",
         "report/report_deliveryslip.xml",
+        "report/stock_secondary_unit_report_views.xml",
     ],
 }
@@ -0,0 +1,28 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import _, http
+from odoo.exceptions import UserError
+from odoo.http import request
+
+
+class StockSecondaryUnitController(http.Controller):
+    @http.route(
+        "/stock_secondary_unit/move_line_quantities", type="json", auth="user"
+    )
+    def set_move_line_quantities(self, updates):
+        """Set the done quantities of move lines from scanned quantities in
+        their secondary units, in a single transaction.
+
+        :param updates: list of ``{"move_line_id", "level", "quantity"}``,
+            ``level`` being 2, 3 or 4 for the second, third and fourth units
+        :return: ``{"lines": [...]}`` with the id, ``qty_done`` and the
+            quantities in all the units of each updated line
+        """
+        try:
+            updates = [
+                (update["move_line_id"], update["level"], update["quantity"])
+                for update in updates
+            ]
+        except (TypeError, KeyError):
+            raise UserError(_("Invalid move line quantity updates.")) from None
+        lines = request.env["stock.move.line"]._set_secondary_unit_quantities(updates)
+        return {"lines": lines}
@@ -1,3 +1,5 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 from . import product
 from . import stock_move
+from . import stock_quant
+from . import stock_secondary_unit_qty
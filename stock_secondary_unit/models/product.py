@@ -1,5 +1,9 @@
 # Copyright 2018 Tecnativa - Sergio Teruel
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from collections import defaultdict
+
+from lxml import etree
+
 from odoo import api, fields, models
 from odoo.tools.float_utils import float_round
 
@@ -24,36 +28,226 @@ class StockProductSecondaryUnit(models.AbstractModel):
         digits="Product Unit of Measure",
     )
 
-    @api.depends("stock_secondary_uom_id",'stock_third_uom_id','stock_fourth_uom_id')
-    def _compute_secondary_unit_qty_available(self):
-        for product in self:
-            if not product.stock_secondary_uom_id:
-                product.secondary_unit_qty_available = 0.0
-            else:
-                qty = product.qty_available / (
-                    product.stock_secondary_uom_id.factor or 1.0
-                )
-                product.secondary_unit_qty_available = float_round(
-                    qty, precision_rounding=product.uom_id.rounding
-                )
-            if not product.stock_third_uom_id:
-                product.third_unit_qty_available = 0.0
+    # the quantities above, read from the quantities on hand stored per
+    # product and company when the stored mode is enabled, see
+    # _schedule_secondary_unit_qty_sync
+    secondary_unit_qty_on_hand = fields.Float(
+        string="Stored Quantity On Hand (2Unit)",
+        compute="_compute_secondary_unit_qty_on_hand",
+        digits="Product Unit of Measure",
+    )
+    third_unit_qty_on_hand = fields.Float(
+        string="Stored Quantity On Hand (3Unit)",
+        compute="_compute_secondary_unit_qty_on_hand",
+        digits="Product Unit of Measure",
+    )
+    fourth_unit_qty_on_hand = fields.Float(
+        string="Stored Quantity On Hand (4Unit)",
+        compute="_compute_secondary_unit_qty_on_hand",
+        digits="Product Unit of Measure",
+    )
+
+    # (unit field, computed on hand field, stored on hand field) per level
+    _stock_unit_levels = (
+        (
+            "stock_secondary_uom_id",
+            "secondary_unit_qty_available",
+            "secondary_unit_qty_on_hand",
+        ),
+        ("stock_third_uom_id", "third_unit_qty_available", "third_unit_qty_on_hand"),
+        (
+            "stock_fourth_uom_id",
+            "fourth_unit_qty_available",
+            "fourth_unit_qty_on_hand",
+        ),
+    )
+
+    def _get_stock_unit_qtys(self, qty):
+        """Return ``qty``, in the unit of measure of the product, converted
+        to each of its inventory units."""
+        rounding = self.uom_id.rounding
+        qtys = []
+        for unit_field, _available_field, _stored_field in self._stock_unit_levels:
+            unit = self[unit_field]
+            if not unit:
+                qtys.append(0.0)
             else:
-                qty = product.qty_available / (
-                    product.stock_third_uom_id.factor or 1.0
-                )
-                product.third_unit_qty_available = float_round(
-                    qty, precision_rounding=product.uom_id.rounding
+                qtys.append(
+                    float_round(qty / (unit.factor or 1.0), precision_rounding=rounding)
                 )
-            if not product.stock_fourth_uom_id:
-                product.fourth_unit_qty_available = 0.0
-            else:
-                qty = product.qty_available / (
-                    product.stock_fourth_uom_id.factor or 1.0
+        return qtys
+
+    @api.depends("stock_secondary_uom_id", "stock_third_uom_id", "stock_fourth_uom_id")
+    def _compute_secondary_unit_qty_available(self):
+        available_fields = [level[1] for level in self._stock_unit_levels]
+        for product in self:
+            qtys = product._get_stock_unit_qtys(product.qty_available)
+            for fname, qty in zip(available_fields, qtys):
+                product[fname] = qty
+
+    @api.depends(
+        "stock_secondary_uom_id.factor",
+        "stock_third_uom_id.factor",
+        "stock_fourth_uom_id.factor",
+    )
+    @api.depends_context("allowed_company_ids")
+    def _compute_secondary_unit_qty_on_hand(self):
+        qty_by_record = self.env["stock.secondary.unit.qty"]._get_quantities(self)
+        stored_fields = [level[2] for level in self._stock_unit_levels]
+        for record in self:
+            qtys = record._get_stock_unit_qtys(qty_by_record[record._origin.id])
+            for fname, qty in zip(stored_fields, qtys):
+                record[fname] = qty
+
+    @api.model
+    def fields_view_get(
+        self, view_id=None, view_type="form", toolbar=False, submenu=False
+    ):
+        res = super().fields_view_get(
+            view_id=view_id, view_type=view_type, toolbar=toolbar, submenu=submenu
+        )
+        if view_type == "tree" and self._secondary_unit_qty_stored_enabled():
+            res["arch"] = self._show_secondary_unit_qty_stored(res["arch"])
+        return res
+
+    @api.model
+    def _show_secondary_unit_qty_stored(self, arch):
+        """Return the list view ``arch`` showing the stored quantities on hand
+        in place of the computed ones."""
+        doc = etree.XML(arch)
+        for _unit_field, available_field, stored_field in self._stock_unit_levels:
+            stored_nodes = doc.xpath("//field[@name='%s']" % stored_field)
+            if not stored_nodes:
+                continue
+            for node in doc.xpath("//field[@name='%s']" % available_field):
+                node.getparent().remove(node)
+            for node in stored_nodes:
+                node.attrib.pop("optional", None)
+        return etree.tostring(doc, encoding="unicode")
+
+    @api.model
+    def _secondary_unit_qty_stored_enabled(self):
+        return bool(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("stock_secondary_unit.stored_qty_on_hand")
+        )
+
+    @api.model
+    def _schedule_secondary_unit_qty_sync(self, product_ids):
+        """Mark the products ``product_ids`` for the update of their stored
+        quantities on hand, which happens once at the end of the
+        transaction."""
+        if not product_ids or not self._secondary_unit_qty_stored_enabled():
+            return
+        data = self.env.cr.precommit.data
+        pending = data.get("stock_secondary_unit.qty_sync")
+        if pending is None:
+            pending = data["stock_secondary_unit.qty_sync"] = set()
+            self.env.cr.precommit.add(
+                self.env["product.product"].sudo()._sync_secondary_unit_qty_pending
+            )
+        pending.update(product_ids)
+
+    @api.model
+    def _sync_secondary_unit_qty_pending(self):
+        product_ids = self.env.cr.precommit.data.pop(
+            "stock_secondary_unit.qty_sync", set()
+        )
+        self.env["stock.secondary.unit.qty"].sudo()._update_quantities(product_ids)
+
+    def _get_stock_unit_qty_by_location(self, location_ids=None):
+        """Return the quantities on hand of the records of ``self`` per
+        location, from a single aggregation of the quants::
+
+            {(record id, location id): {
+                "warehouse_id": warehouse id or False,
+                "qty": quantity in the unit of measure of the product,
+                "secondary_unit_qty_available": quantity in the 2nd unit,
+                "third_unit_qty_available": quantity in the 3rd unit,
+                "fourth_unit_qty_available": quantity in the 4th unit,
+            }}
+
+        Only internal locations are considered, limited to the children of
+        ``location_ids`` when given. The quantities of templates are the sums
+        of the ones of their variants.
+        """
+        if self._name == "product.product":
+            products = self
+        else:
+            products = self.product_variant_ids
+        domain = [
+            ("product_id", "in", products.ids),
+            ("location_id.usage", "=", "internal"),
+        ]
+        if location_ids:
+            domain.append(("location_id", "child_of", location_ids))
+        groups = self.env["stock.quant"].read_group(
+            domain,
+            ["product_id", "location_id", "quantity:sum"],
+            ["product_id", "location_id"],
+            lazy=False,
+        )
+        locations = self.env["stock.location"].browse(
+            {g["location_id"][0] for g in groups}
+        )
+        warehouse_by_location = {loc.id: loc.warehouse_id.id for loc in locations}
+        qty_by_key = defaultdict(float)
+        for group in groups:
+            record_id = group["product_id"][0]
+            if self._name != "product.product":
+                record_id = products.browse(record_id).product_tmpl_id.id
+            qty_by_key[(record_id, group["location_id"][0])] += group["quantity"]
+        available_fields = [level[1] for level in self._stock_unit_levels]
+        records = self.browse({key[0] for key in qty_by_key})
+        result = {}
+        for (record_id, location_id), qty in qty_by_key.items():
+            values = dict(
+                zip(
+                    available_fields,
+                    records.browse(record_id)._get_stock_unit_qtys(qty),
                 )
-                product.fourth_unit_qty_available = float_round(
-                    qty, precision_rounding=product.uom_id.rounding
+            )
+            values["warehouse_id"] = warehouse_by_location[location_id]
+            values["qty"] = qty
+            result[(record_id, location_id)] = values
+        return result
+
+    def _get_stock_unit_qty_by_warehouse(self, warehouse_ids=None):
+        """Return the quantities on hand of the records of ``self`` per
+        warehouse, in the format of :meth:`_get_stock_unit_qty_by_location`
+        keyed by ``(record id, warehouse id)``."""
+        warehouses = self.env["stock.warehouse"].browse(warehouse_ids)
+        qty_by_key = defaultdict(float)
+        for (record_id, _location_id), values in self._get_stock_unit_qty_by_location(
+            warehouses.view_location_id.ids or None
+        ).items():
+            qty_by_key[(record_id, values["warehouse_id"])] += values["qty"]
+        available_fields = [level[1] for level in self._stock_unit_levels]
+        records = self.browse({key[0] for key in qty_by_key})
+        result = {}
+        for (record_id, warehouse_id), qty in qty_by_key.items():
+            values = dict(
+                zip(
+                    available_fields,
+                    records.browse(record_id)._get_stock_unit_qtys(qty),
                 )
+            )
+            values["warehouse_id"] = warehouse_id
+            values["qty"] = qty
+            result[(record_id, warehouse_id)] = values
+        return result
+
+    @api.model
+    def _cron_recompute_secondary_unit_qty_stored(self, batch_size=1000):
+        """Recompute the stored quantities on hand of all the products."""
+        if not self._secondary_unit_qty_stored_enabled():
+            return
+        product_ids = self.env["product.product"].search([("type", "=", "product")]).ids
+        for start in range(0, len(product_ids), batch_size):
+            self.env["stock.secondary.unit.qty"].sudo()._update_quantities(
+                product_ids[start : start + batch_size]
+            )
 
 
 class ProductTemplate(models.Model):
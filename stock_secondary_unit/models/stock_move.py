@@ -1,8 +1,13 @@
 # Copyright 2018 Tecnativa - Sergio Teruel
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
-from odoo import api, fields, models
+from collections import defaultdict
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
 from odoo.tools.float_utils import float_round
 
+from odoo.addons.product_secondary_unit.profiling import profiled
+
 
 class StockMove(models.Model):
     _inherit = ["stock.move", "product.secondary.unit.mixin"]
@@ -23,7 +28,12 @@ class StockMove(models.Model):
         store=True, readonly=False, compute="_compute_product_uom_qty", copy=True
     )
 
-    @api.depends("secondary_uom_qty", "secondary_uom_id")
+    @api.model_create_multi
+    def create(self, vals_list):
+        self._prepare_default_units(vals_list)
+        return super().create(vals_list)
+
+    @api.depends(lambda x: x._get_target_qty_depends("product_uom_qty"))
     def _compute_product_uom_qty(self):
         self._compute_helper_target_field_qty()
 
@@ -32,17 +42,24 @@ class StockMove(models.Model):
         self._onchange_helper_product_uom_for_secondary()
 
     def _merge_moves_fields(self):
+        """Sum the quantities of all the unit levels in a single pass over
+        the moves, so none of them needs to be recomputed after the merge"""
         res = super()._merge_moves_fields()
-        res["secondary_uom_qty"] = sum(self.mapped("secondary_uom_qty"))
-        res["third_uom_qty"] = sum(self.mapped("third_uom_qty"))
-        res["fourht_uom_qty"] = sum(self.mapped("fourth_uom_qty"))
+        qty_fields = [level.qty_field for level in self._get_unit_plan()]
+        # like product_uom_qty, extra moves keep the quantities of the first one
+        merge_extra = self.env.context.get("merge_extra") and bool(self.picking_id)
+        totals = [0.0] * len(qty_fields)
+        for move in self[:1] if merge_extra else self:
+            for i, fname in enumerate(qty_fields):
+                totals[i] += move[fname]
+        res.update(zip(qty_fields, totals))
         return res
 
     @api.model
     def _prepare_merge_moves_distinct_fields(self):
         """Don't merge moves with distinct secondary units"""
         distinct_fields = super()._prepare_merge_moves_distinct_fields()
-        distinct_fields += ["secondary_uom_id",'third_uom_id','fourth_uom_id']
+        distinct_fields += [level.unit_field for level in self._get_unit_plan()]
         return distinct_fields
 
 
@@ -55,44 +72,98 @@ class StockMoveLine(models.Model):
 
     qty_done = fields.Float(store=True, readonly=False, compute="_compute_qty_done")
 
-    @api.model
-    def create(self, vals):
-        move = self.env["stock.move"].browse(vals.get("move_id", False))
-        if move.secondary_uom_id:
-            uom = self.env["uom.uom"].browse(vals["product_uom_id"])
-            factor = move.secondary_uom_id.factor * uom.factor
-            move_line_qty = vals.get("product_uom_qty", vals.get("qty_done", 0.0))
-            qty = float_round(
-                move_line_qty / (factor or 1.0),
-                precision_rounding=move.secondary_uom_id.uom_id.rounding,
-            )
-            vals.update(
-                {"secondary_uom_qty": qty, "secondary_uom_id": move.secondary_uom_id.id}
-            )
-        if move.third_uom_id:
-            uom = self.env["uom.uom"].browse(vals["product_uom_id"])
-            factor = move.third_uom_id.factor * uom.factor
+    @api.model_create_multi
+    @profiled
+    def create(self, vals_list):
+        moves = self.env["stock.move"].browse(
+            {vals["move_id"] for vals in vals_list if vals.get("move_id")}
+        )
+        uoms = self.env["uom.uom"].browse(
+            {vals["product_uom_id"] for vals in vals_list if vals.get("product_uom_id")}
+        )
+        plan = self._get_unit_plan()
+        # Read the units of all the moves, their factors and roundings, and
+        # the factors of the uoms once for the whole batch
+        units = self.env["product.secondary.unit"].concat(
+            *(moves.mapped(level.unit_field) for level in plan)
+        )
+        units.mapped("uom_id.rounding")
+        uoms.mapped("factor")
+        lines_without_move = []
+        for vals in vals_list:
+            move = moves.browse(vals.get("move_id"))
+            if not move:
+                lines_without_move.append(vals)
+                continue
+            uom = uoms.browse(vals.get("product_uom_id"))
             move_line_qty = vals.get("product_uom_qty", vals.get("qty_done", 0.0))
-            qty = float_round(
-                move_line_qty / (factor or 1.0),
-                precision_rounding=move.third_uom_id.uom_id.rounding,
-            )
-            vals.update(
-                {"third_uom_qty": qty, "third_uom_id": move.secondary_uom_id.id}
-            )
-        if move.fourth_uom_id:
-            uom = self.env["uom.uom"].browse(vals["product_uom_id"])
-            factor = move.fourth_uom_id.factor * uom.factor
-            move_line_qty = vals.get("product_uom_qty", vals.get("qty_done", 0.0))
-            qty = float_round(
-                move_line_qty / (factor or 1.0),
-                precision_rounding=move.fourth_uom_id.uom_id.rounding,
-            )
-            vals.update(
-                {"fourth_uom_qty": qty, "fourth_uom_id": move.secondary_uom_id.id}
-            )
-        return super().create(vals)
-
-    @api.depends("secondary_uom_id", "secondary_uom_qty","third_uom_id", "third_uom_qty","fourth_uom_id", "fourth_uom_qty")
+            for level in plan:
+                unit = move[level.unit_field]
+                if not unit:
+                    continue
+                factor, rounding, __ = unit._get_conversion(uom)
+                qty = float_round(
+                    move_line_qty / (factor or 1.0), precision_rounding=rounding
+                )
+                vals.update({level.qty_field: qty, level.unit_field: unit.id})
+        self._prepare_default_units(lines_without_move)
+        return super().create(vals_list)
+
+    @api.depends(lambda x: x._get_target_qty_depends("qty_done"))
     def _compute_qty_done(self):
         self._compute_helper_target_field_qty()
+
+    @api.model
+    def _set_secondary_unit_quantities(self, updates):
+        """Set the done quantities of move lines from quantities in one of
+        their unit levels, and return the resulting quantities.
+
+        :param updates: iterable of ``(move line id, level, quantity)``, the
+            level being 2, 3 or 4 for the second, third and fourth units;
+            only the last update of each line is applied
+        :return: a list of dicts with the id, ``qty_done`` and the quantities
+            of all the unit levels of each updated line
+        """
+        plan = self._get_unit_plan()
+        # only the last update of a line is applied, as if they were applied
+        # in turn
+        last_updates = {}
+        for line_id, level_number, qty in updates:
+            for value in (line_id, level_number):
+                if not isinstance(value, int) or isinstance(value, bool):
+                    raise UserError(_("Invalid move line or unit level %r.") % value)
+            if level_number not in range(2, len(plan) + 2):
+                raise UserError(_("Unknown unit level %s.") % level_number)
+            try:
+                qty = float(qty)
+            except (TypeError, ValueError):
+                raise UserError(_("Invalid quantity %r.") % qty) from None
+            last_updates.pop(line_id, None)
+            last_updates[line_id] = (level_number, qty)
+        lines = self.browse(last_updates).exists()
+        # read the units of all the levels of the lines at once
+        self.env["product.secondary.unit"].concat(
+            *(lines.mapped(level.unit_field) for level in plan)
+        ).mapped("uom_id.rounding")
+        ids_by_vals = defaultdict(list)
+        for line_id, (level_number, qty) in last_updates.items():
+            line = lines.browse(line_id)
+            if line not in lines:
+                raise UserError(_("Move line %s does not exist.") % line_id)
+            level = plan[level_number - 2]
+            unit = line[level.unit_field]
+            if not unit:
+                raise UserError(
+                    _("Move line %(line)s has no unit for level %(level)s.")
+                    % {"line": line_id, "level": level_number}
+                )
+            factor, __, rounding = unit._get_conversion(line.product_uom_id)
+            vals = {level.qty_field: qty}
+            if unit.dependency_type != "independent":
+                vals["qty_done"] = float_round(qty * factor, precision_rounding=rounding)
+            ids_by_vals[tuple(sorted(vals.items()))].append(line_id)
+        # write the lines sharing the same values at once
+        for vals, ids in ids_by_vals.items():
+            lines.browse(ids).write(dict(vals))
+        fnames = ["qty_done"] + [level.qty_field for level in plan]
+        return lines.read(fnames)
@@ -0,0 +1,29 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import api, models
+
+
+class StockQuant(models.Model):
+    _inherit = "stock.quant"
+
+    def _schedule_secondary_unit_qty_sync(self):
+        self.env["product.product"]._schedule_secondary_unit_qty_sync(
+            self.product_id.ids
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        quants = super().create(vals_list)
+        quants._schedule_secondary_unit_qty_sync()
+        return quants
+
+    def write(self, vals):
+        if {"quantity", "product_id", "location_id"} & set(vals):
+            self._schedule_secondary_unit_qty_sync()
+        res = super().write(vals)
+        if "product_id" in vals:
+            self._schedule_secondary_unit_qty_sync()
+        return res
+
+    def unlink(self):
+        self._schedule_secondary_unit_qty_sync()
+        return super().unlink()
@@ -0,0 +1,129 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from collections import defaultdict
+
+from odoo import api, fields, models
+
+
+class StockSecondaryUnitQty(models.Model):
+    """Quantities on hand of the products per company, in the unit of
+    measure of the product, kept up to date from the quants when the stored
+    mode is enabled. They live in a table of their own so that updating them
+    neither locks nor touches the rows of the products and templates."""
+
+    _name = "stock.secondary.unit.qty"
+    _description = "Stock Secondary Unit Quantity On Hand"
+    _log_access = False
+
+    product_id = fields.Many2one(
+        "product.product", "Product", required=True, ondelete="cascade", index=True
+    )
+    product_tmpl_id = fields.Many2one(
+        "product.template",
+        "Product Template",
+        required=True,
+        ondelete="cascade",
+        index=True,
+    )
+    company_id = fields.Many2one(
+        "res.company", "Company", required=True, ondelete="cascade"
+    )
+    quantity = fields.Float(digits="Product Unit of Measure")
+
+    _sql_constraints = [
+        (
+            "product_company_uniq",
+            "unique(product_id, company_id)",
+            "The quantity on hand of a product is stored once per company.",
+        )
+    ]
+
+    @api.model
+    def _update_quantities(self, product_ids):
+        """Recompute the quantities on hand of the products ``product_ids``
+        from a single aggregation of their quants, and write the ones that
+        changed."""
+        if not product_ids:
+            return
+        groups = (
+            self.env["stock.quant"]
+            .sudo()
+            .read_group(
+                [
+                    ("product_id", "in", list(product_ids)),
+                    ("location_id.usage", "=", "internal"),
+                    ("company_id", "!=", False),
+                ],
+                ["product_id", "company_id", "quantity:sum"],
+                ["product_id", "company_id"],
+                lazy=False,
+            )
+        )
+        qty_by_key = {
+            (g["product_id"][0], g["company_id"][0]): g["quantity"] for g in groups
+        }
+        self.flush()
+        self.env.cr.execute(
+            "SELECT product_id, company_id, quantity FROM %s WHERE product_id IN %%s"
+            % self._table,
+            [tuple(product_ids)],
+        )
+        current = {(row[0], row[1]): row[2] for row in self.env.cr.fetchall()}
+        # the products that have no stock anymore in a company go back to 0
+        for key in current:
+            qty_by_key.setdefault(key, 0.0)
+        changed = {
+            key: qty for key, qty in qty_by_key.items() if current.get(key) != qty
+        }
+        if not changed:
+            return
+        products = self.env["product.product"].browse({key[0] for key in changed})
+        tmpl_by_product = {
+            row["id"]: row["product_tmpl_id"]
+            for row in products.with_context(active_test=False).read(
+                ["product_tmpl_id"], load=False
+            )
+        }
+        rows = [
+            (product_id, tmpl_by_product[product_id], company_id, qty)
+            for (product_id, company_id), qty in changed.items()
+        ]
+        # an upsert, so that concurrent transactions adding the first row of
+        # a product do not fail on the unique constraint
+        self.env.cr.execute(
+            """
+            INSERT INTO {table} (product_id, product_tmpl_id, company_id, quantity)
+            VALUES {values}
+            ON CONFLICT (product_id, company_id)
+            DO UPDATE SET quantity = EXCLUDED.quantity
+            """.format(
+                table=self._table, values=", ".join(["%s"] * len(rows))
+            ),
+            rows,
+        )
+        self.invalidate_cache()
+        stored_fields = [
+            level[2] for level in self.env["product.product"]._stock_unit_levels
+        ]
+        self.env["product.product"].invalidate_cache(fnames=stored_fields)
+        self.env["product.template"].invalidate_cache(fnames=stored_fields)
+
+    @api.model
+    def _get_quantities(self, records):
+        """Return ``{record id: quantity}`` with the quantities on hand of the
+        products or templates ``records`` in the companies of the
+        environment."""
+        record_field = (
+            "product_id" if records._name == "product.product" else "product_tmpl_id"
+        )
+        groups = self.sudo().read_group(
+            [
+                (record_field, "in", records._origin.ids),
+                ("company_id", "in", self.env.companies.ids),
+            ],
+            [record_field, "quantity:sum"],
+            [record_field],
+        )
+        qty_by_record = defaultdict(float)
+        for group in groups:
+            qty_by_record[group[record_field][0]] += group["quantity"]
+        return qty_by_record
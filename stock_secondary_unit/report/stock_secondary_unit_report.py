@@ -0,0 +1,181 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import api, fields, models
+
+
+class StockSecondaryUnitReport(models.Model):
+    """Moved and on hand quantities in secondary units, pre-aggregated per
+    product, unit, location and month in a materialized view, which is
+    refreshed by a scheduled action."""
+
+    _name = "stock.secondary.unit.report"
+    _description = "Stock Secondary Unit Report"
+    _auto = False
+    _order = "date desc"
+
+    date = fields.Date(readonly=True)
+    product_id = fields.Many2one("product.product", "Product", readonly=True)
+    product_tmpl_id = fields.Many2one(
+        "product.template", "Product Template", readonly=True
+    )
+    location_id = fields.Many2one("stock.location", "Location", readonly=True)
+    company_id = fields.Many2one("res.company", "Company", readonly=True)
+    secondary_uom_id = fields.Many2one(
+        "product.secondary.unit", "Second unit", readonly=True
+    )
+    third_uom_id = fields.Many2one("product.secondary.unit", "Third unit", readonly=True)
+    fourth_uom_id = fields.Many2one(
+        "product.secondary.unit", "Fourth unit", readonly=True
+    )
+    qty_moved = fields.Float(
+        "Moved Qty", digits="Product Unit of Measure", readonly=True
+    )
+    secondary_qty_moved = fields.Float(
+        "Moved Qty (2Unit)", digits="Product Unit of Measure", readonly=True
+    )
+    third_qty_moved = fields.Float(
+        "Moved Qty (3Unit)", digits="Product Unit of Measure", readonly=True
+    )
+    fourth_qty_moved = fields.Float(
+        "Moved Qty (4Unit)", digits="Product Unit of Measure", readonly=True
+    )
+    qty_on_hand = fields.Float(
+        "Quantity On Hand", digits="Product Unit of Measure", readonly=True
+    )
+    secondary_qty_on_hand = fields.Float(
+        "Quantity On Hand (2Unit)", digits="Product Unit of Measure", readonly=True
+    )
+    third_qty_on_hand = fields.Float(
+        "Quantity On Hand (3Unit)", digits="Product Unit of Measure", readonly=True
+    )
+    fourth_qty_on_hand = fields.Float(
+        "Quantity On Hand (4Unit)", digits="Product Unit of Measure", readonly=True
+    )
+
+    def _query(self):
+        """Return the query of the view. Done moves give a row entering their
+        destination and a row leaving their source location, with their own
+        secondary units; quants give the quantities on hand in the inventory
+        units of their product, in the month they entered the stock.
+
+        Each row has a ``grouping_key``, the text of its kind and grouping
+        columns, which the unique index of the view is built on. The id of a
+        row is a 48 bits hash of that key followed by 4 bits ranking the
+        rows sharing the hash, so that it stays the same from one refresh to
+        the next, remains an exact number in the web client, and a hash
+        collision cannot make two rows share an id."""
+        return """
+            SELECT
+                hashed.hash * 16
+                + row_number() OVER (
+                    PARTITION BY hashed.hash ORDER BY hashed.grouping_key
+                ) - 1 AS id,
+                hashed.*
+            FROM (
+                SELECT
+                    ('x' || left(md5(keyed.grouping_key), 12))::bit(48)::bigint
+                        AS hash,
+                    keyed.*
+                FROM (
+                    SELECT
+                        ROW(
+                            report.kind,
+                            report.date,
+                            report.product_id,
+                            report.location_id,
+                            report.company_id,
+                            report.secondary_uom_id,
+                            report.third_uom_id,
+                            report.fourth_uom_id
+                        )::text AS grouping_key,
+                        report.*
+                    FROM (
+                        SELECT
+                            'move' AS kind,
+                            date_trunc('month', m.date)::date AS date,
+                            m.product_id,
+                            pp.product_tmpl_id,
+                            l.location_id,
+                            m.company_id,
+                            m.secondary_uom_id,
+                            m.third_uom_id,
+                            m.fourth_uom_id,
+                            SUM(l.sign * m.product_qty) AS qty_moved,
+                            SUM(l.sign * m.secondary_uom_qty) AS secondary_qty_moved,
+                            SUM(l.sign * m.third_uom_qty) AS third_qty_moved,
+                            SUM(l.sign * m.fourth_uom_qty) AS fourth_qty_moved,
+                            0.0 AS qty_on_hand,
+                            0.0 AS secondary_qty_on_hand,
+                            0.0 AS third_qty_on_hand,
+                            0.0 AS fourth_qty_on_hand
+                        FROM stock_move m
+                        JOIN product_product pp ON pp.id = m.product_id
+                        CROSS JOIN LATERAL (
+                            VALUES (m.location_dest_id, 1), (m.location_id, -1)
+                        ) AS l(location_id, sign)
+                        WHERE m.state = 'done'
+                        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+                        UNION ALL
+                        SELECT
+                            'quant',
+                            date_trunc('month', q.in_date)::date AS date,
+                            q.product_id,
+                            pp.product_tmpl_id,
+                            q.location_id,
+                            q.company_id,
+                            pt.stock_secondary_uom_id,
+                            pt.stock_third_uom_id,
+                            pt.stock_fourth_uom_id,
+                            0.0,
+                            0.0,
+                            0.0,
+                            0.0,
+                            SUM(q.quantity),
+                            COALESCE(SUM(q.quantity) / NULLIF(MAX(u2.factor), 0), 0.0),
+                            COALESCE(SUM(q.quantity) / NULLIF(MAX(u3.factor), 0), 0.0),
+                            COALESCE(SUM(q.quantity) / NULLIF(MAX(u4.factor), 0), 0.0)
+                        FROM stock_quant q
+                        JOIN stock_location sl ON sl.id = q.location_id
+                        JOIN product_product pp ON pp.id = q.product_id
+                        JOIN product_template pt ON pt.id = pp.product_tmpl_id
+                        LEFT JOIN product_secondary_unit u2
+                            ON u2.id = pt.stock_secondary_uom_id
+                        LEFT JOIN product_secondary_unit u3
+                            ON u3.id = pt.stock_third_uom_id
+                        LEFT JOIN product_secondary_unit u4
+                            ON u4.id = pt.stock_fourth_uom_id
+                        WHERE sl.usage = 'internal'
+                        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+                    ) AS report
+                ) AS keyed
+            ) AS hashed
+        """
+
+    def init(self):
+        self.env.cr.execute(
+            "DROP MATERIALIZED VIEW IF EXISTS %s CASCADE" % self._table
+        )
+        self.env.cr.execute(
+            "CREATE MATERIALIZED VIEW %s AS (%s)" % (self._table, self._query())
+        )
+        # a unique index is required to refresh the view concurrently, it is
+        # built on the grouping columns, which cannot collide
+        self.env.cr.execute(
+            "CREATE UNIQUE INDEX %s_grouping_key_idx ON %s (grouping_key)"
+            % (self._table, self._table)
+        )
+        self.env.cr.execute(
+            "CREATE INDEX %s_id_idx ON %s (id)" % (self._table, self._table)
+        )
+        self.env.cr.execute(
+            "CREATE INDEX %s_product_location_date_idx ON %s "
+            "(product_id, location_id, date)" % (self._table, self._table)
+        )
+
+    @api.model
+    def _refresh_view(self):
+        """Refresh the view without locking the reads of the report."""
+        self.flush()
+        self.env.cr.execute(
+            "REFRESH MATERIALIZED VIEW CONCURRENTLY %s" % self._table
+        )
+        self.invalidate_cache()
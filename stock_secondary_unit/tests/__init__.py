@@ -1,2 +1,3 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 from . import test_stock_secondary_unit
+from . import test_stock_secondary_unit_benchmark
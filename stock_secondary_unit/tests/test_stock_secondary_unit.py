@@ -1,5 +1,10 @@
 # Copyright 2018 Tecnativa - Sergio Teruel
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import patch
+
+from lxml import etree
+
+from odoo.exceptions import UserError
 from odoo.tests import Form, TransactionCase, tagged
 
 
@@ -146,6 +151,163 @@ class TestProductSecondaryUnit(TransactionCase):
         self.assertEqual(uom_qty, 20.0)
         self.assertEqual(secondary_uom_qty, 40.0)
 
+    def test_move_line_create_all_unit_levels(self):
+        product = self.product_template.product_variant_ids[0]
+        units = product.secondary_uom_ids
+        picking = self.StockPicking.create(
+            {
+                "location_id": self.location_supplier.id,
+                "location_dest_id": self.location_stock.id,
+                "picking_type_id": self.picking_type_in.id,
+                "move_ids_without_package": [
+                    (
+                        0,
+                        None,
+                        {
+                            "product_id": product.id,
+                            "name": product.display_name,
+                            "secondary_uom_id": units[0].id,
+                            "third_uom_id": units[1].id,
+                            "fourth_uom_id": units[2].id,
+                            "product_uom": product.uom_id.id,
+                            "product_uom_qty": 9.0,
+                            "location_id": self.location_supplier.id,
+                            "location_dest_id": self.location_stock.id,
+                        },
+                    )
+                ],
+            }
+        )
+        picking.action_confirm()
+        move_line = picking.move_line_ids
+        self.assertEqual(len(move_line), 1)
+        self.assertEqual(move_line.secondary_uom_id, units[0])
+        self.assertEqual(move_line.third_uom_id, units[1])
+        self.assertEqual(move_line.fourth_uom_id, units[2])
+        self.assertEqual(move_line.secondary_uom_qty, 18.0)
+        self.assertEqual(move_line.third_uom_qty, 10.0)
+        self.assertEqual(move_line.fourth_uom_qty, 0.9)
+
+    def test_move_create_default_units(self):
+        product = self.product_template.product_variant_ids[0]
+        units = product.secondary_uom_ids
+        move_vals = {
+            "product_id": product.id,
+            "name": product.display_name,
+            "product_uom": product.uom_id.id,
+            "product_uom_qty": 9.0,
+            "location_id": self.location_supplier.id,
+            "location_dest_id": self.location_stock.id,
+        }
+        # a product with units but no configured defaults gives no unit
+        move = self.env["stock.move"].create(move_vals)
+        self.assertFalse(move.secondary_uom_id)
+        self.assertFalse(move.third_uom_id)
+        self.assertFalse(move.fourth_uom_id)
+        self.product_template.write(
+            {
+                "default_secondary_uom_id": units[0].id,
+                "default_third_uom_id": units[2].id,
+            }
+        )
+        vals_without_qty = dict(move_vals)
+        del vals_without_qty["product_uom_qty"]
+        move, move_without_qty = self.env["stock.move"].create(
+            [move_vals, vals_without_qty]
+        )
+        self.assertEqual(move.secondary_uom_id, units[0])
+        self.assertEqual(move.third_uom_id, units[2])
+        self.assertFalse(move.fourth_uom_id)
+        self.assertEqual(move.product_uom_qty, 9.0)
+        self.assertEqual(move.secondary_uom_qty, 18.0)
+        self.assertEqual(move.third_uom_qty, 0.9)
+        # no unit is defaulted when no quantity can be converted into it
+        self.assertFalse(move_without_qty.secondary_uom_id)
+        self.assertFalse(move_without_qty.third_uom_id)
+
+    def test_merge_moves_keeps_all_unit_quantities(self):
+        product = self.product_template.product_variant_ids[0]
+        units = product.secondary_uom_ids
+        move_vals = {
+            "product_id": product.id,
+            "name": product.display_name,
+            "secondary_uom_id": units[0].id,
+            "third_uom_id": units[1].id,
+            "fourth_uom_id": units[2].id,
+            "product_uom": product.uom_id.id,
+            "product_uom_qty": 9.0,
+            "location_id": self.location_supplier.id,
+            "location_dest_id": self.location_stock.id,
+        }
+        picking = self.StockPicking.create(
+            {
+                "location_id": self.location_supplier.id,
+                "location_dest_id": self.location_stock.id,
+                "picking_type_id": self.picking_type_in.id,
+                "move_ids_without_package": [(0, None, move_vals), (0, None, move_vals)],
+            }
+        )
+        # a quantity that a recompute from product_uom_qty would not give back
+        picking.move_lines.write({"fourth_uom_qty": 3.0})
+        picking.action_confirm()
+        move = picking.move_lines
+        self.assertEqual(len(move), 1)
+        self.assertEqual(move.product_uom_qty, 18.0)
+        self.assertEqual(move.secondary_uom_qty, 36.0)
+        self.assertEqual(move.third_uom_qty, 20.0)
+        self.assertEqual(move.fourth_uom_qty, 6.0)
+
+    def test_move_line_recompute_touched_levels(self):
+        product = self.product_template.product_variant_ids[0]
+        units = product.secondary_uom_ids
+        line = self.env["stock.move.line"].create(
+            {
+                "product_id": product.id,
+                "product_uom_id": product.uom_id.id,
+                "location_id": self.location_supplier.id,
+                "location_dest_id": self.location_stock.id,
+                "secondary_uom_id": units[0].id,
+                "third_uom_id": units[1].id,
+                "fourth_uom_id": units[2].id,
+                "qty_done": 9.0,
+                "company_id": self.env.company.id,
+            }
+        )
+        line.flush()
+        Unit = type(self.env["product.secondary.unit"])
+        get_conversion = Unit._get_conversion
+        conversions = []
+
+        def counting_conversion(unit, uom):
+            conversions.append(unit)
+            return get_conversion(unit, uom)
+
+        def update(vals):
+            """Write ``vals`` on the line and return the number of quantities
+            converted and the fields then written to the database"""
+            conversions.clear()
+            with patch.object(Unit, "_get_conversion", counting_conversion):
+                line.write(vals)
+                line.recompute()
+            written = set(self.env.all.towrite["stock.move.line"].get(line.id, ()))
+            line.flush()
+            return len(conversions), written
+
+        # the third unit does not drive qty_done: nothing else is recomputed
+        self.assertEqual(update({"third_uom_qty": 3.0}), (0, {"third_uom_qty"}))
+        self.assertEqual(line.qty_done, 9.0)
+        self.assertEqual(line.fourth_uom_qty, 0.9)
+        # the modified fields are forgotten once the computations are done
+        self.assertIsNone(line._get_unit_touched())
+        # the second unit does: qty_done, then the third and fourth quantities
+        self.assertEqual(
+            update({"secondary_uom_qty": 4.0}),
+            (3, {"secondary_uom_qty", "qty_done", "third_uom_qty", "fourth_uom_qty"}),
+        )
+        self.assertEqual(line.qty_done, 2.0)
+        self.assertEqual(line.third_uom_qty, 2.22)
+        self.assertEqual(line.fourth_uom_qty, 0.2)
+
     def test_picking_secondary_unit(self):
         product = self.product_template.product_variant_ids[0]
         with Form(
@@ -228,3 +390,179 @@ class TestProductSecondaryUnit(TransactionCase):
         picking.action_confirm()
         self.assertEqual(len(picking.move_lines), 1)
         self.assertEqual(picking.move_lines.secondary_uom_qty, 2)
+
+    def test_stored_secondary_unit_qty_on_hand(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "stock_secondary_unit.stored_qty_on_hand", "1"
+        )
+        variant = self.product_template.product_variant_ids[0]
+        self.env["stock.quant"].create(
+            {
+                "product_id": variant.id,
+                "location_id": self.warehouse.lot_stock_id.id,
+                "quantity": 5.0,
+            }
+        )
+        self.assertEqual(variant.secondary_unit_qty_on_hand, 0.0)
+        self.env["base"].flush()
+        self.env.cr.execute(
+            "SELECT write_date FROM product_product WHERE id = %s", [variant.id]
+        )
+        write_date = self.env.cr.fetchone()[0]
+        self.env.cr.precommit.run()
+        self.assertEqual(variant.secondary_unit_qty_on_hand, 30.0)
+        self.assertEqual(self.product_template.secondary_unit_qty_on_hand, 50.0)
+        # the quantities are kept apart from the rows of the products
+        stored = self.env["stock.secondary.unit.qty"].search(
+            [("product_id", "=", variant.id)]
+        )
+        self.assertEqual(stored.company_id, self.env.company)
+        self.assertEqual(stored.quantity, 15.0)
+        self.env.cr.execute(
+            "SELECT write_date FROM product_product WHERE id = %s", [variant.id]
+        )
+        self.assertEqual(self.env.cr.fetchone()[0], write_date)
+        # changing the inventory units converts the stored quantities
+        self.product_template.stock_third_uom_id = self.product_template.secondary_uom_ids[2]
+        self.assertEqual(variant.third_unit_qty_on_hand, 1.5)
+        self.product_template.secondary_uom_ids[2].factor = 5
+        self.assertEqual(variant.third_unit_qty_on_hand, 3.0)
+        self.assertEqual(self.product_template.third_unit_qty_on_hand, 5.0)
+        # the list views show the stored quantities in place of the computed ones
+        arch = self.env["product.product"].fields_view_get(
+            view_id=self.env.ref("product.product_product_tree_view").id,
+            view_type="tree",
+        )["arch"]
+        doc = etree.XML(arch)
+        self.assertFalse(doc.xpath("//field[@name='secondary_unit_qty_available']"))
+        node = doc.xpath("//field[@name='secondary_unit_qty_on_hand']")[0]
+        self.assertNotIn("optional", node.attrib)
+
+    def test_stock_unit_qty_by_location(self):
+        variants = self.product_template.product_variant_ids
+        shelf = self.env["stock.location"].create(
+            {"name": "Shelf", "location_id": self.warehouse.lot_stock_id.id}
+        )
+        self.env["stock.quant"].create(
+            {"product_id": variants[0].id, "location_id": shelf.id, "quantity": 4.0}
+        )
+        result = variants._get_stock_unit_qty_by_location()
+        stock_id = self.warehouse.lot_stock_id.id
+        self.assertEqual(result[(variants[0].id, stock_id)]["qty"], 10.0)
+        self.assertEqual(
+            result[(variants[0].id, shelf.id)]["secondary_unit_qty_available"], 8.0
+        )
+        self.assertEqual(
+            result[(variants[0].id, shelf.id)]["warehouse_id"], self.warehouse.id
+        )
+        by_warehouse = self.product_template._get_stock_unit_qty_by_warehouse(
+            self.warehouse.ids
+        )
+        self.assertEqual(
+            by_warehouse[(self.product_template.id, self.warehouse.id)][
+                "secondary_unit_qty_available"
+            ],
+            48.0,
+        )
+
+    def test_secondary_unit_report(self):
+        product = self.product_template.product_variant_ids[0]
+        move = self.env["stock.move"].create(
+            {
+                "product_id": product.id,
+                "name": product.display_name,
+                "secondary_uom_id": product.secondary_uom_ids[0].id,
+                "product_uom": product.uom_id.id,
+                "product_uom_qty": 5.0,
+                "location_id": self.location_supplier.id,
+                "location_dest_id": self.location_stock.id,
+            }
+        )
+        move._action_confirm()
+        move.quantity_done = 5.0
+        move._action_done()
+        Report = self.env["stock.secondary.unit.report"]
+        Report._refresh_view()
+        fields = ["qty_moved", "secondary_qty_moved", "secondary_qty_on_hand"]
+        groups = Report.read_group(
+            [
+                ("product_tmpl_id", "=", self.product_template.id),
+                ("location_id", "=", self.location_stock.id),
+            ],
+            fields,
+            ["product_tmpl_id"],
+        )
+        self.assertEqual([groups[0][fname] for fname in fields], [5.0, 10.0, 50.0])
+        groups = Report.read_group(
+            [("product_id", "=", product.id)], ["qty_moved"], ["location_id"]
+        )
+        self.assertEqual(
+            {g["location_id"][0]: g["qty_moved"] for g in groups},
+            {self.location_stock.id: 5.0, self.location_supplier.id: -5.0},
+        )
+        # the rows keep their ids from one refresh to the next
+        ids = Report.search([("product_id", "=", product.id)]).ids
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertTrue(all(0 < record_id < 2 ** 52 for record_id in ids))
+        Report._refresh_view()
+        self.assertEqual(Report.search([("product_id", "=", product.id)]).ids, ids)
+        # users only see the rows of their companies
+        company = self.env["res.company"].create({"name": "Other company"})
+        user = self.env["res.users"].create(
+            {
+                "name": "Other stock manager",
+                "login": "other_stock_manager",
+                "company_id": company.id,
+                "company_ids": [(6, 0, company.ids)],
+                "groups_id": [(6, 0, self.env.ref("stock.group_stock_manager").ids)],
+            }
+        )
+        self.assertFalse(
+            Report.with_user(user).search([("product_id", "=", product.id)])
+        )
+
+    def test_set_secondary_unit_quantities(self):
+        product = self.product_template.product_variant_ids[0]
+        units = product.secondary_uom_ids
+        lines = self.env["stock.move.line"].create(
+            [
+                {
+                    "product_id": product.id,
+                    "product_uom_id": product.uom_id.id,
+                    "location_id": self.location_supplier.id,
+                    "location_dest_id": self.location_stock.id,
+                    "secondary_uom_id": units[0].id,
+                    "third_uom_id": units[1].id,
+                    "fourth_uom_id": units[2].id,
+                    "company_id": self.env.company.id,
+                }
+                for i in range(2)
+            ]
+        )
+        result = self.env["stock.move.line"]._set_secondary_unit_quantities(
+            [(lines[0].id, 3, 5.0), (lines[1].id, 2, 4.0)]
+        )
+        self.assertEqual(
+            {r["id"]: r["qty_done"] for r in result},
+            {lines[0].id: 4.5, lines[1].id: 2.0},
+        )
+        self.assertEqual(lines[0].secondary_uom_qty, 9.0)
+        self.assertEqual(lines[0].third_uom_qty, 5.0)
+        self.assertEqual(lines[0].fourth_uom_qty, 0.45)
+        self.assertEqual(lines[1].third_uom_qty, 2.22)
+        # the last update of a line wins
+        self.env["stock.move.line"]._set_secondary_unit_quantities(
+            [(lines[0].id, 2, 4.0), (lines[0].id, 2, 5.0), (lines[0].id, 2, 4.0)]
+        )
+        self.assertEqual(lines[0].secondary_uom_qty, 4.0)
+        self.assertEqual(lines[0].qty_done, 2.0)
+        for update in [
+            (lines[0].id, 5, 1.0),
+            (lines[0].id, 2.0, 1.0),
+            (lines[0].id, True, 1.0),
+            (str(lines[0].id), 2, 1.0),
+            (lines[0].id, 2, "many"),
+            (lines[0].id, 2, None),
+        ]:
+            with self.assertRaises(UserError):
+                self.env["stock.move.line"]._set_secondary_unit_quantities([update])
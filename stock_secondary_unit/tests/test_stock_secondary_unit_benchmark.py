@@ -0,0 +1,238 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import logging
+import os
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.product_secondary_unit import profiling
+
+_logger = logging.getLogger(__name__)
+
+SIZES = (1000, 10000, 50000)
+PRODUCTS = 50
+MODELS = ("stock.move", "stock.move.line")
+
+# What a phase may cost per 1000 moves: seconds, SQL queries, and records
+# recomputed by the secondary unit computes. Set
+# STOCK_SECONDARY_UNIT_BENCHMARK_FACTOR to scale the time budgets on slower
+# machines.
+BUDGETS = {
+    # the quantities of the moves are given, and qty_done of each move line
+    # created by either phase is computed once
+    "confirm": {"seconds": 4.0, "queries": 1500, "recomputes": 1000},
+    "reserve": {"seconds": 6.0, "queries": 3000, "recomputes": 1000},
+    # qty_done of the move lines, then their three unit quantities
+    "validate": {"seconds": 10.0, "queries": 6000, "recomputes": 4000},
+    # the merged quantities are written, not recomputed
+    "merge": {"seconds": 2.0, "queries": 100, "recomputes": 0},
+}
+
+# SQL queries the secondary units may add to each phase of a small picking,
+# over the same picking without units
+EXTRA_QUERIES = {"confirm": 4, "reserve": 8, "validate": 8}
+
+
+class StockSecondaryUnitBenchmarkCase(TransactionCase):
+    """Products with three secondary units, and receipts of them."""
+
+    products_count = PRODUCTS
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.StockPicking = cls.env["stock.picking"]
+        cls.location_supplier = cls.env.ref("stock.stock_location_suppliers")
+        cls.location_stock = cls.env.ref("stock.stock_location_stock")
+        cls.picking_type_in = cls.env.ref("stock.picking_type_in")
+        cls.product_uom_kg = cls.env.ref("uom.product_uom_kgm")
+        cls.product_uom_unit = cls.env.ref("uom.product_uom_unit")
+        cls.products = cls.env["product.product"].create(
+            [
+                {
+                    "name": "Benchmark product %s" % i,
+                    "type": "product",
+                    "uom_id": cls.product_uom_kg.id,
+                    "uom_po_id": cls.product_uom_kg.id,
+                    "secondary_uom_ids": [
+                        (
+                            0,
+                            0,
+                            {
+                                "code": code,
+                                "name": "unit-%s" % factor,
+                                "uom_id": cls.product_uom_unit.id,
+                                "factor": factor,
+                            },
+                        )
+                        for code, factor in (("A", 0.5), ("B", 0.9), ("C", 10))
+                    ],
+                }
+                for i in range(cls.products_count)
+            ]
+        )
+
+    def _create_picking(self, size, mergeable, products=None):
+        """Return a receipt of ``size`` moves of 9 kg, in three units when
+        the products have them. Moves of the same product are merged on
+        confirmation when ``mergeable``, their distinct prices keep them
+        apart otherwise."""
+        products = products or self.products
+        move_vals = []
+        for i in range(size):
+            product = products[i % len(products)]
+            units = product.secondary_uom_ids
+            vals = {
+                "product_id": product.id,
+                "name": product.name,
+                "product_uom": product.uom_id.id,
+                "product_uom_qty": 9.0,
+                "price_unit": 1.0 if mergeable else i + 1.0,
+                "location_id": self.location_supplier.id,
+                "location_dest_id": self.location_stock.id,
+            }
+            if units:
+                vals.update(
+                    {
+                        "secondary_uom_id": units[0].id,
+                        "third_uom_id": units[1].id,
+                        "fourth_uom_id": units[2].id,
+                    }
+                )
+            move_vals.append(vals)
+        picking = self.StockPicking.create(
+            {
+                "location_id": self.location_supplier.id,
+                "location_dest_id": self.location_stock.id,
+                "picking_type_id": self.picking_type_in.id,
+                "move_ids_without_package": [(0, None, vals) for vals in move_vals],
+            }
+        )
+        picking.flush()
+        return picking
+
+    @staticmethod
+    def _phases(picking):
+        """Return the confirmation, reservation and validation of
+        ``picking``, by name."""
+
+        def validate():
+            picking.move_line_ids.write({"qty_done": 9.0})
+            picking._action_done()
+
+        return {
+            "confirm": picking.action_confirm,
+            "reserve": picking.action_assign,
+            "validate": validate,
+        }
+
+
+@tagged("-at_install", "post_install")
+class TestStockSecondaryUnitQueryCount(StockSecondaryUnitBenchmarkCase):
+    """Bound the SQL queries the secondary units add to the flow of a small
+    picking."""
+
+    products_count = 3
+
+    def test_picking_flow_query_count(self):
+        plain_products = self.env["product.product"].create(
+            [
+                {
+                    "name": "Product without units %s" % i,
+                    "type": "product",
+                    "uom_id": self.product_uom_kg.id,
+                    "uom_po_id": self.product_uom_kg.id,
+                }
+                for i in range(self.products_count)
+            ]
+        )
+        size = self.products_count
+        # warm the caches up, then count the queries of the flow of a
+        # picking without units
+        warm_up = self._create_picking(size, False, plain_products)
+        for phase in self._phases(warm_up).values():
+            phase()
+        self.env["base"].flush()
+        picking = self._create_picking(size, False, plain_products)
+        baseline = {
+            name: profiling.measure(self.env, phase, MODELS)[1]["queries"]
+            for name, phase in self._phases(picking).items()
+        }
+        picking = self._create_picking(size, False)
+        for name, phase in self._phases(picking).items():
+            with self.assertQueryCount(baseline[name] + EXTRA_QUERIES[name]):
+                phase()
+        self.assertEqual(picking.state, "done")
+        self.assertEqual(picking.move_lines.mapped("fourth_uom_qty"), [0.9] * size)
+
+
+@tagged("-at_install", "post_install", "-standard", "stock_secondary_unit_benchmark")
+class TestStockSecondaryUnitBenchmark(StockSecondaryUnitBenchmarkCase):
+    """Time the confirmation, reservation, validation and merge of pickings
+    with moves in 2nd, 3rd and 4th units, count their SQL queries and unit
+    recomputations, and fail when a phase goes over its budget. Run with
+    ``--test-tags stock_secondary_unit_benchmark``."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # count the computes of every environment, whatever its context
+        cls.env["ir.config_parameter"].sudo().set_param(profiling.PARAMETER, "1")
+
+    def _check_budgets(self, size, results):
+        factor = float(os.environ.get("STOCK_SECONDARY_UNIT_BENCHMARK_FACTOR", 1))
+        for phase, stats in results.items():
+            _logger.info(
+                "Picking of %s moves with secondary units, %-8s %8.3fs %8s queries "
+                "%8s recomputes",
+                size,
+                phase,
+                stats["seconds"],
+                stats["queries"],
+                stats["recomputes"],
+            )
+        for phase, stats in results.items():
+            budget = BUDGETS[phase]
+            for key, limit in budget.items():
+                if key == "seconds":
+                    limit *= factor
+                self.assertLessEqual(
+                    stats[key],
+                    limit * size / 1000,
+                    "%s of %s moves is over its %s budget" % (phase, size, key),
+                )
+
+    def test_benchmark_picking_flow(self):
+        for size in SIZES:
+            with self.subTest(size=size):
+                picking = self._create_picking(size, mergeable=False)
+                results = {
+                    name: profiling.measure(self.env, phase, MODELS)[1]
+                    for name, phase in self._phases(picking).items()
+                }
+                self.assertEqual(picking.state, "done")
+                self.assertEqual(len(picking.move_lines), size)
+                for move in picking.move_lines:
+                    self.assertEqual(move.secondary_uom_qty, 18.0)
+                    self.assertEqual(move.third_uom_qty, 10.0)
+                    self.assertEqual(move.fourth_uom_qty, 0.9)
+                self._check_budgets(size, results)
+
+    def test_benchmark_merge_moves(self):
+        for size in SIZES:
+            with self.subTest(size=size):
+                picking = self._create_picking(size, mergeable=True)
+                # merge the moves alone, without the rest of the confirmation
+                picking.move_lines.write({"state": "confirmed"})
+                picking.flush()
+                __, stats = profiling.measure(
+                    self.env, picking.move_lines._merge_moves, MODELS
+                )
+                moves = picking.move_lines
+                self.assertEqual(len(moves), PRODUCTS)
+                per_product = size / PRODUCTS
+                for move in moves:
+                    self.assertAlmostEqual(move.product_uom_qty, 9.0 * per_product)
+                    self.assertAlmostEqual(move.secondary_uom_qty, 18.0 * per_product)
+                    self.assertAlmostEqual(move.third_uom_qty, 10.0 * per_product)
+                    self.assertAlmostEqual(move.fourth_uom_qty, 0.9 * per_product)
+                self._check_budgets(size, {"merge": stats})